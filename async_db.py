@@ -0,0 +1,311 @@
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Iterator, List
+
+import db
+
+# Reads and writes get separate pools so a slow dashboard query or export can
+# never hold up webhook ingestion (and vice versa).
+READ_WORKERS = int(os.environ.get("DB_READ_WORKERS", "4"))
+WRITE_WORKERS = int(os.environ.get("DB_WRITE_WORKERS", "1"))
+READ_QUEUE_LIMIT = int(os.environ.get("DB_READ_QUEUE_LIMIT", "64"))
+WRITE_QUEUE_LIMIT = int(os.environ.get("DB_WRITE_QUEUE_LIMIT", "256"))
+# A write that has started is always waited for, so DB_WRITE_TIMEOUT only
+# bounds how long it may wait in the queue.
+READ_TIMEOUT = float(os.environ.get("DB_READ_TIMEOUT", "10"))
+WRITE_TIMEOUT = float(os.environ.get("DB_WRITE_TIMEOUT", "10"))
+
+
+class DatabaseBusyError(Exception):
+    """Raised when a pool already has its maximum number of queued calls"""
+
+
+class DatabaseTimeoutError(Exception):
+    """Raised when a database call does not finish within the pool timeout"""
+
+
+class DatabaseExecutor:
+    """
+    Bounded thread pool that runs blocking db.py calls for the event loop.
+
+    With finish_started, the timeout only covers the wait in the queue: a
+    call that has started is awaited to the end, so a write that goes on
+    to commit is never reported as failed.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        workers: int,
+        queue_limit: int,
+        timeout: float,
+        finish_started: bool = False,
+    ):
+        self.name = name
+        self.timeout = timeout
+        self.finish_started = finish_started
+        self._workers = workers
+        self._queue_limit = queue_limit
+        self._executor = None
+        # One slot per running or queued call; exhausting them means the
+        # pool is saturated and the caller should back off.
+        self._slots = threading.BoundedSemaphore(workers + queue_limit)
+
+    def start(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self._workers, thread_name_prefix=f"db-{self.name}"
+            )
+
+    def shutdown(self, wait: bool = True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run fn(*args, **kwargs) on the pool and await its result"""
+        if self._executor is None:
+            self.start()
+        if not self._slots.acquire(blocking=False):
+            raise DatabaseBusyError(f"Database {self.name} queue is full")
+
+        try:
+            future = self._executor.submit(functools.partial(fn, *args, **kwargs))
+        except BaseException:
+            self._slots.release()
+            raise
+        # Release from the worker side so a timed-out call keeps its slot
+        # until the thread is actually free again.
+        future.add_done_callback(lambda _: self._slots.release())
+
+        wrapped = asyncio.wrap_future(future)
+        try:
+            return await asyncio.wait_for(asyncio.shield(wrapped), self.timeout)
+        except asyncio.TimeoutError:
+            # cancel() only succeeds while the call is still queued
+            if future.cancel() or not self.finish_started:
+                wrapped.add_done_callback(_discard_result)
+                raise DatabaseTimeoutError(
+                    f"Database {self.name} call timed out after {self.timeout}s"
+                )
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        return await wrapped
+
+
+def _discard_result(future: asyncio.Future):
+    """Retrieve an abandoned call's exception so it is not logged as lost"""
+    if not future.cancelled():
+        future.exception()
+
+
+readers = DatabaseExecutor("read", READ_WORKERS, READ_QUEUE_LIMIT, READ_TIMEOUT)
+writers = DatabaseExecutor(
+    "write", WRITE_WORKERS, WRITE_QUEUE_LIMIT, WRITE_TIMEOUT, finish_started=True
+)
+
+_EXHAUSTED = object()
+
+# Callbacks run on the event loop after every successful write
+_write_listeners: List[Callable[[], None]] = []
+
+
+def add_write_listener(callback: Callable[[], None]):
+    _write_listeners.append(callback)
+
+
+def remove_write_listener(callback: Callable[[], None]):
+    if callback in _write_listeners:
+        _write_listeners.remove(callback)
+
+
+def start():
+    """Start the read and write pools"""
+    readers.start()
+    writers.start()
+
+
+def shutdown():
+    """Wait for in-flight calls and stop both pools"""
+    writers.shutdown()
+    readers.shutdown()
+
+
+async def run_read(fn: Callable, *args, **kwargs) -> Any:
+    return await readers.run(fn, *args, **kwargs)
+
+
+async def run_write(fn: Callable, *args, **kwargs) -> Any:
+    result = await writers.run(fn, *args, **kwargs)
+    for callback in list(_write_listeners):
+        callback()
+    return result
+
+
+async def iterate_read(iterator: Iterator) -> AsyncIterator:
+    """
+    Drive a blocking iterator from the read pool one item at a time, so
+    long streaming reads share the read pool's limits instead of holding a
+    thread of their own.
+    """
+    try:
+        while True:
+            item = await run_read(next, iterator, _EXHAUSTED)
+            if item is _EXHAUSTED:
+                break
+            yield item
+    finally:
+        # Closing a generator only runs its cleanup (closing its
+        # connection), which is quick enough to do inline.
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            try:
+                close()
+            except ValueError:
+                # Still running on a worker after a timeout; it is cleaned
+                # up when garbage collected instead.
+                pass
+
+
+async def insert_error_logs(*args, **kwargs):
+    return await run_write(db.insert_error_logs, *args, **kwargs)
+
+
+async def get_logs_page(*args, **kwargs):
+    return await run_read(db.get_logs_page, *args, **kwargs)
+
+
+async def get_change_version(*args, **kwargs) -> int:
+    return await run_read(db.get_change_version, *args, **kwargs)
+
+
+async def get_sync_state(*args, **kwargs):
+    return await run_read(db.get_sync_state, *args, **kwargs)
+
+
+async def get_stats(*args, **kwargs):
+    return await run_read(db.get_stats, *args, **kwargs)
+
+
+async def get_aggregates(*args, **kwargs):
+    return await run_read(db.get_aggregates, *args, **kwargs)
+
+
+async def has_logs_to_roll_up(*args, **kwargs) -> bool:
+    return await run_read(db.has_logs_to_roll_up, *args, **kwargs)
+
+
+async def roll_up_logs(*args, **kwargs) -> int:
+    return await run_write(db.roll_up_logs, *args, **kwargs)
+
+
+async def prune_rollups(*args, **kwargs) -> int:
+    return await run_write(db.prune_rollups, *args, **kwargs)
+
+
+async def delete_expired_logs(*args, **kwargs) -> int:
+    return await run_write(db.delete_expired_logs, *args, **kwargs)
+
+
+async def get_excess_cut(*args, **kwargs):
+    return await run_read(db.get_excess_cut, *args, **kwargs)
+
+
+async def delete_excess_logs(*args, **kwargs) -> int:
+    return await run_write(db.delete_excess_logs, *args, **kwargs)
+
+
+async def get_zap_names(*args, **kwargs):
+    return await run_read(db.get_zap_names, *args, **kwargs)
+
+
+async def prune_tombstones(*args, **kwargs) -> int:
+    return await run_write(db.prune_tombstones, *args, **kwargs)
+
+
+async def incremental_vacuum(*args, **kwargs) -> int:
+    return await run_write(db.incremental_vacuum, *args, **kwargs)
+
+
+async def get_log_archives(*args, **kwargs):
+    return await run_read(db.get_log_archives, *args, **kwargs)
+
+
+async def discard_log_archive(*args, **kwargs) -> bool:
+    return await run_write(db.discard_log_archive, *args, **kwargs)
+
+
+async def purge_discarded_logs(*args, **kwargs):
+    return await run_write(db.purge_discarded_logs, *args, **kwargs)
+
+
+async def get_changes(*args, **kwargs):
+    return await run_read(db.get_changes, *args, **kwargs)
+
+
+async def update_log_status(*args, **kwargs) -> bool:
+    return await run_write(db.update_log_status, *args, **kwargs)
+
+
+async def clear_all_logs(*args, **kwargs):
+    return await run_write(db.clear_all_logs, *args, **kwargs)
+
+
+async def get_error_groups(*args, **kwargs):
+    return await run_read(db.get_error_groups, *args, **kwargs)
+
+
+async def get_error_group(*args, **kwargs):
+    return await run_read(db.get_error_group, *args, **kwargs)
+
+
+async def update_group_status(*args, **kwargs) -> bool:
+    return await run_write(db.update_group_status, *args, **kwargs)
+
+
+async def get_log_templates(*args, **kwargs):
+    return await run_read(db.get_log_templates, *args, **kwargs)
+
+
+async def set_template_explanation(*args, **kwargs):
+    return await run_write(db.set_template_explanation, *args, **kwargs)
+
+
+async def get_idempotency_key(*args, **kwargs):
+    return await run_read(db.get_idempotency_key, *args, **kwargs)
+
+
+async def save_idempotency_keys(*args, **kwargs) -> int:
+    return await run_write(db.save_idempotency_keys, *args, **kwargs)
+
+
+async def seed_explanation_rules(*args, **kwargs) -> bool:
+    return await run_write(db.seed_explanation_rules, *args, **kwargs)
+
+
+async def get_rules_version() -> int:
+    return await run_read(db.get_rules_version)
+
+
+async def get_explanation_rules():
+    return await run_read(db.get_explanation_rules)
+
+
+async def create_explanation_rule(*args, **kwargs):
+    return await run_write(db.create_explanation_rule, *args, **kwargs)
+
+
+async def update_explanation_rule(*args, **kwargs):
+    return await run_write(db.update_explanation_rule, *args, **kwargs)
+
+
+async def delete_explanation_rule(*args, **kwargs) -> bool:
+    return await run_write(db.delete_explanation_rule, *args, **kwargs)
+
+
+async def check_health():
+    return await run_read(db.check_health)
@@ -0,0 +1,290 @@
+import asyncio
+import codecs
+import json
+import os
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from db import to_epoch_ms
+from ingest import check_row, insert_rows
+
+# Rows per insert transaction, and the largest single JSON value or NDJSON
+# line we are willing to hold in memory while waiting for the rest of it.
+BULK_CHUNK_SIZE = int(os.environ.get("BULK_CHUNK_SIZE", "1000"))
+BULK_MAX_ITEM_BYTES = int(os.environ.get("BULK_MAX_ITEM_BYTES", str(1024 * 1024)))
+# Duplicate and failed rows listed in a response; the counts include the rest
+BULK_MAX_REPORTED = int(os.environ.get("BULK_MAX_REPORTED", "1000"))
+
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson")
+
+# Parsed items are (value, error); exactly one of the two is set
+Item = Tuple[Any, Optional[str]]
+
+
+class JSONArrayParser:
+    """
+    Incrementally yields the elements of a top-level JSON array.
+
+    A syntax error cannot be skipped over in a JSON array, so it sets
+    `error` and the parser stops consuming input.
+    """
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._started = False
+        self._finished = False
+        self._need_comma = False
+        self.error = None
+
+    def feed(self, chunk: bytes) -> List[Item]:
+        if self.error:
+            return []
+        try:
+            self._buf += self._utf8.decode(chunk)
+        except UnicodeDecodeError:
+            self.error = "Body is not valid UTF-8"
+            return []
+        return self._drain(final=False)
+
+    def close(self) -> List[Item]:
+        if self.error:
+            return []
+        try:
+            self._buf += self._utf8.decode(b"", final=True)
+        except UnicodeDecodeError:
+            self.error = "Body is not valid UTF-8"
+            return []
+        items = self._drain(final=True)
+        if not self.error and not self._finished:
+            self.error = "Unexpected end of JSON array"
+        return items
+
+    def _drain(self, final: bool) -> List[Item]:
+        buf, pos, items = self._buf, 0, []
+        while not self.error:
+            while pos < len(buf) and buf[pos] in " \t\r\n":
+                pos += 1
+            if pos == len(buf):
+                break
+            ch = buf[pos]
+            if self._finished:
+                self.error = "Unexpected data after JSON array"
+            elif not self._started:
+                if ch != "[":
+                    self.error = "Body must be a JSON array"
+                self._started = True
+                pos += 1
+            elif ch == "]":
+                self._finished = True
+                pos += 1
+            elif self._need_comma:
+                if ch != ",":
+                    self.error = "Expected ',' or ']' in JSON array"
+                self._need_comma = False
+                pos += 1
+            else:
+                try:
+                    value, end = self._decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError as e:
+                    # Most likely the value continues in the next chunk
+                    if final or len(buf) - pos > BULK_MAX_ITEM_BYTES:
+                        self.error = f"Invalid JSON: {e.msg}"
+                    break
+                if (
+                    not final
+                    and isinstance(value, (int, float))
+                    and (end == len(buf) or buf[end] in ".eE+-0123456789")
+                ):
+                    # A number cut off by the chunk boundary ("12" of
+                    # "12.5") decodes fine, so wait for its terminator.
+                    break
+                items.append((value, None))
+                self._need_comma = True
+                pos = end
+        self._buf = buf[pos:]
+        return items
+
+
+class NDJSONParser:
+    """
+    Incrementally yields one value per line; bad lines become errors.
+
+    Lines are split before decoding, so a line that is not valid UTF-8 is
+    rejected on its own instead of being stored with replaced characters.
+    """
+
+    def __init__(self):
+        self._buf = b""
+        self.error = None
+
+    def feed(self, chunk: bytes) -> List[Item]:
+        if self.error:
+            return []
+        self._buf += chunk
+        lines = self._buf.split(b"\n")
+        self._buf = lines.pop()
+        if len(self._buf) > BULK_MAX_ITEM_BYTES:
+            self.error = "NDJSON line too long"
+        return [item for item in map(self._parse, lines) if item is not None]
+
+    def close(self) -> List[Item]:
+        if self.error:
+            return []
+        item = self._parse(self._buf)
+        self._buf = b""
+        return [item] if item is not None else []
+
+    @staticmethod
+    def _parse(line: bytes) -> Optional[Item]:
+        try:
+            text = line.decode("utf-8").strip()
+        except UnicodeDecodeError:
+            return None, "Line is not valid UTF-8"
+        if not text:
+            return None
+        try:
+            return json.loads(text), None
+        except json.JSONDecodeError as e:
+            return None, f"Invalid JSON: {e.msg}"
+
+
+def parser_for(content_type: str):
+    """Pick a parser from the request Content-Type (NDJSON or JSON array)"""
+    media_type = content_type.split(";")[0].strip().lower()
+    if media_type in NDJSON_CONTENT_TYPES:
+        return NDJSONParser()
+    return JSONArrayParser()
+
+
+def _validate(value: Any) -> Tuple[Optional[Dict], Optional[str]]:
+    if not isinstance(value, dict):
+        return None, "Item must be a JSON object"
+    zap_name = value.get("zap_name")
+    error_message = value.get("error_message")
+    explanation = value.get("explanation")
+    if not isinstance(zap_name, str) or not isinstance(error_message, str):
+        return None, "Missing zap_name or error_message"
+    if not zap_name or not error_message:
+        return None, "Missing zap_name or error_message"
+    if explanation is not None and not isinstance(explanation, str):
+        return None, "explanation must be a string"
+    if value.get("timestamp") is not None:
+        try:
+            value = dict(value, timestamp=to_epoch_ms(value["timestamp"]))
+        except ValueError as e:
+            return None, str(e)
+    return value, None
+
+
+async def ingest_stream(
+    chunks: AsyncIterator[bytes], parser, explain: Callable[[str], str]
+) -> Dict:
+    """
+    Parse a streamed body and insert its rows in chunked transactions.
+
+    Returns counts, the ids created as [first, last] ranges (in input order
+    of the created rows), and the first BULK_MAX_REPORTED rows that were
+    "duplicate" or "error" (with detail) by index. A row that fails its
+    chunk's transaction only fails itself; if the database fails, the rest
+    of the body is skipped and "aborted" is set.
+    """
+    total = 0
+    pending: List[Tuple[int, Tuple[str, str, Optional[str], Optional[int]]]] = []
+    in_flight = None
+    failure = None
+    counts = {"inserted": 0, "duplicates": 0, "errors": 0}
+    ids: List[List[int]] = []
+    rejected: List[Dict] = []
+
+    def created(log_id: int):
+        counts["inserted"] += 1
+        if ids and ids[-1][1] == log_id - 1:
+            ids[-1][1] = log_id
+        else:
+            ids.append([log_id, log_id])
+
+    def reject(index: int, error: Optional[str] = None):
+        counts["duplicates" if error is None else "errors"] += 1
+        if len(rejected) < BULK_MAX_REPORTED:
+            if error is None:
+                rejected.append({"index": index, "status": "duplicate"})
+            else:
+                rejected.append({"index": index, "status": "error", "detail": error})
+
+    async def write(batch):
+        nonlocal failure
+        try:
+            outcomes = await insert_rows([row for _, row in batch])
+        except Exception as e:
+            failure = f"Database write failed: {e}"
+            outcomes = [e] * len(batch)
+        for (index, _), outcome in zip(batch, outcomes):
+            if isinstance(outcome, Exception):
+                reject(index, str(outcome))
+            elif outcome == -1:
+                reject(index)
+            else:
+                created(outcome)
+
+    async def flush():
+        # Keep one transaction in flight while the next chunk is parsed
+        nonlocal pending, in_flight
+        if in_flight is not None:
+            await in_flight
+            in_flight = None
+        if pending and not failure:
+            in_flight = asyncio.ensure_future(write(pending))
+        pending = []
+
+    async def accept(items: List[Item]):
+        # One network chunk can hold any number of rows, so flush as soon
+        # as a transaction's worth is pending
+        nonlocal total
+        for value, error in items:
+            if failure:
+                return
+            index = total
+            total += 1
+            if error is None:
+                value, error = _validate(value)
+            if error is not None:
+                reject(index, error)
+                continue
+            explanation = value.get("explanation") or explain(value["error_message"])
+            row = (
+                value["zap_name"],
+                value["error_message"],
+                explanation,
+                value.get("timestamp"),
+            )
+            try:
+                check_row(row)
+            except ValueError as e:
+                reject(index, str(e))
+                continue
+            pending.append((index, row))
+            if len(pending) >= BULK_CHUNK_SIZE:
+                await flush()
+
+    try:
+        async for chunk in chunks:
+            await accept(parser.feed(chunk))
+            if parser.error or failure:
+                # Rows parsed before the error are still written
+                break
+        else:
+            await accept(parser.close())
+        await flush()
+    finally:
+        # Never leave a chunk's transaction unreported, even if the
+        # client went away
+        if in_flight is not None:
+            await in_flight
+
+    # Rows skipped after a failure are in neither the counts nor the lists
+    rejected.sort(key=lambda entry: entry["index"])
+    response = dict(counts, ids=ids, rejected=rejected)
+    if parser.error or failure:
+        response["aborted"] = parser.error or failure
+    return response
@@ -0,0 +1,180 @@
+import os
+import sqlite3
+import threading
+import urllib.request
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional, Set
+
+# Connection tuning, applied to every pooled connection
+BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", "5000"))
+CACHE_SIZE_KB = int(os.environ.get("DB_CACHE_SIZE_KB", "16384"))
+MMAP_SIZE = int(os.environ.get("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+
+class ConnectionPool:
+    """
+    Long-lived SQLite connections for db.py.
+
+    Every thread that reads gets its own reader connection, created on first
+    use and reused afterwards. All writes go through a single writer
+    connection guarded by a lock, which matches SQLite's one-writer model and
+    lets WAL readers run alongside it.
+
+    A readonly pool opens the file with mode=ro and sets none of the
+    persistent pragmas, so it never changes the database (e.g. for a dry
+    run); its writer fails on the first statement.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        trace: Optional[Callable[[str], None]] = None,
+        readonly: bool = False,
+    ):
+        self.path = path
+        # Called with every SQL statement run on the pool's connections
+        self.trace = trace
+        self.readonly = readonly
+        self._local = threading.local()
+        self._readers: Set[sqlite3.Connection] = set()
+        self._readers_lock = threading.Lock()
+        self._writer = None
+        self._write_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        path = self.path
+        if self.readonly:
+            url = urllib.request.pathname2url(os.path.abspath(path))
+            path = f"file:{url}?mode=ro"
+        conn = sqlite3.connect(
+            path,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            isolation_level=None,
+            uri=self.readonly,
+        )
+        conn.row_factory = sqlite3.Row
+        if self.trace is not None:
+            conn.set_trace_callback(self.trace)
+        if not self.readonly:
+            # Only takes effect on a new, empty database; existing ones are
+            # switched with db.enable_incremental_vacuum()
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        return conn
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Open a dedicated, configured connection outside the pool. Used for
+        long streaming reads whose cursor outlives a single pool checkout;
+        the caller must close it.
+        """
+        return self._connect()
+
+    def _discard_reader(self, conn: sqlite3.Connection):
+        with self._readers_lock:
+            self._readers.discard(conn)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """Yield this thread's reader connection"""
+        conn = getattr(self._local, "conn", None)
+        # A connection dropped by health_check() or close() is no longer in
+        # the registry, so the thread transparently gets a fresh one.
+        if conn is None or conn not in self._readers:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.add(conn)
+        try:
+            yield conn
+        except sqlite3.DatabaseError:
+            # A broken connection is dropped so the next call reconnects;
+            # ordinary query errors leave it in place.
+            if not self._is_healthy(conn):
+                self._discard_reader(conn)
+            raise
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        """Yield the writer connection inside a BEGIN IMMEDIATE transaction"""
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self._connect()
+            conn = self._writer
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                yield conn
+            except BaseException:
+                try:
+                    if conn.in_transaction:
+                        conn.rollback()
+                except sqlite3.Error:
+                    pass
+                if not self._is_healthy(conn):
+                    self._writer = None
+                raise
+            else:
+                if conn.in_transaction:
+                    conn.commit()
+
+    @staticmethod
+    def _is_healthy(conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def health_check(self, timeout: float = 1.0) -> Dict:
+        """
+        Check the writer and the calling thread's reader, replacing dead
+        ones. Other threads' readers may be in use right now, and a sqlite3
+        connection must not be used by two threads at once; reader() drops
+        a broken one the next time its own thread fails on it.
+        """
+        replaced = 0
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and conn in self._readers and not self._is_healthy(conn):
+            self._discard_reader(conn)
+            replaced = 1
+
+        # A writer busy with a long transaction is reported but not failed
+        writer = "busy"
+        if self._write_lock.acquire(timeout=timeout):
+            try:
+                if self._writer is not None and not self._is_healthy(self._writer):
+                    self._writer = None
+                if self._writer is None:
+                    self._writer = self._connect()
+                writer = "ok" if self._is_healthy(self._writer) else "failed"
+            except sqlite3.Error:
+                writer = "failed"
+            finally:
+                self._write_lock.release()
+
+        return {
+            "ok": writer != "failed",
+            "writer": writer,
+            "readers": len(self._readers),
+            "readers_replaced": replaced,
+        }
+
+    def close(self):
+        """Close every pooled connection; later calls reconnect lazily"""
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._readers_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers.clear()
@@ -1,84 +1,1095 @@
 import sqlite3
 import os
-from typing import List, Dict, Optional
+import json
+import math
+import base64
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import migrations
+from connection_pool import ConnectionPool
+from dedup import DedupWindow
+from fingerprint import content_hash, fingerprint
+from migrations import Migration
+from miner import TemplateMiner
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_FILE = os.path.join(BASE_DIR, "logs.db")
 
+pool = ConnectionPool(DB_FILE)
 
-def init_db():
-    """Initialize the database with required tables"""
-    with sqlite3.connect(DB_FILE) as conn:
-        cursor = conn.cursor()
+DEFAULT_EXPLANATION = "No specific explanation available"
 
-        # Create main error logs table
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS error_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                zap_name TEXT NOT NULL,
-                error_message TEXT NOT NULL,
-                explanation TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                status TEXT DEFAULT 'unresolved',
-                UNIQUE(zap_name, error_message, timestamp)
-            )
+# Learns templates of unexplained messages as they are inserted. Only used
+# under the writer lock; _miner_version is the templates_version it has
+# loaded, so templates learned by other workers are picked up first.
+_miner = TemplateMiner()
+_miner_version = 0
+
+# Content hashes of recently stored logs. Only trusted while this process
+# made the last write: _dedup_version is the change version it wrote.
+_dedup = DedupWindow()
+_dedup_version: Optional[int] = None
+
+
+# Accepted event times (epoch ms): 1970-01-01 up to the end of year 9999
+MIN_EVENT_TS = 0
+MAX_EVENT_TS = 253402300799999
+
+# Rollup resolutions (bucket size in ms) and the columns logs are counted
+# by; get_aggregates serves at most AGGREGATE_MAX_BUCKETS buckets per call.
+ROLLUP_BUCKETS = {"1m": 60_000, "1h": 3_600_000, "1d": 86_400_000}
+ROLLUP_DIMENSIONS = ("zap_name", "status", "explanation")
+AGGREGATE_MAX_BUCKETS = 1500
+AGGREGATE_DEFAULT_BUCKETS = 60
+
+# Names of the tables clear_all_logs leaves behind, suffixed with the
+# change version of the clear
+ARCHIVE_PREFIX = "archived_logs_"
+DISCARD_PREFIX = "discarded_logs_"
+
+# Columns returned for a log. timestamp is when the error happened in the
+# Zap (event time), ingested_at when we stored it.
+LOG_COLUMNS = """
+    id, zap_name, error_message, explanation,
+    strftime('%Y-%m-%d %H:%M:%S', event_ts / 1000, 'unixepoch') as timestamp,
+    event_ts,
+    strftime('%Y-%m-%d %H:%M:%S', timestamp) as ingested_at,
+    status
+"""
+
+
+def _add_column(cursor, table: str, column: str, definition: str) -> bool:
+    """Add a column to an existing table unless it is already there"""
+    columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+    if column in columns:
+        return False
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return True
+
+
+def to_epoch_ms(value) -> int:
+    """
+    Parse an event time: epoch seconds or milliseconds (number or numeric
+    string), or an ISO 8601 string (UTC unless it has an offset). Raises
+    ValueError for anything else, including times outside years 1970-9999.
+    """
+    original = value
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid timestamp: {value!r}")
+    if isinstance(value, str):
+        text = value.strip()
+        try:
+            value = float(text)
+        except ValueError:
+            try:
+                parsed = datetime.fromisoformat(text.replace("Z", "+00:00"))
+            except ValueError:
+                raise ValueError(f"Invalid timestamp: {value!r}")
+            if parsed.tzinfo is None:
+                parsed = parsed.replace(tzinfo=timezone.utc)
+            return check_event_ts(int(parsed.timestamp() * 1000))
+    if not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(f"Invalid timestamp: {original!r}")
+    # Values this large are already milliseconds (seconds would be > year 5000)
+    return check_event_ts(int(value if abs(value) >= 1e11 else value * 1000))
+
+
+def check_event_ts(event_ts: int) -> int:
+    """Return event_ts (epoch ms) unchanged; ValueError outside 1970-9999"""
+    if not MIN_EVENT_TS <= event_ts <= MAX_EVENT_TS:
+        raise ValueError("Timestamp must be between 1970 and 9999")
+    return event_ts
+
+
+def check_text(value: str, field: str = "Text") -> str:
+    """Return value unchanged; ValueError unless it is a str storable as UTF-8"""
+    if not isinstance(value, str):
+        raise ValueError(f"{field} must be a string")
+    try:
+        value.encode("utf-8")
+    except UnicodeEncodeError:
+        raise ValueError(f"{field} must be valid UTF-8 (no unpaired surrogates)")
+    return value
+
+
+def _drop_unique_constraint(cursor):
+    """
+    Rebuild error_logs without the old UNIQUE(zap_name, error_message,
+    timestamp) constraint, whose index held a full copy of every message.
+    Duplicates are caught by content hash within DEDUP_WINDOW_SECONDS now.
+    """
+    cursor.execute("SELECT sql FROM sqlite_master WHERE name = 'error_logs'")
+    if "UNIQUE" not in cursor.fetchone()[0]:
+        return
+    columns = (
+        "id, zap_name, error_message, explanation, timestamp, status, "
+        "version, group_id, template_id, event_ts"
+    )
+    cursor.execute(
         """
+        CREATE TABLE error_logs_rebuild (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            zap_name TEXT NOT NULL,
+            error_message TEXT NOT NULL,
+            explanation TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            status TEXT DEFAULT 'unresolved',
+            version INTEGER NOT NULL DEFAULT 0,
+            group_id INTEGER,
+            template_id INTEGER,
+            content_hash INTEGER,
+            event_ts INTEGER
+        )
+    """
+    )
+    cursor.execute(
+        f"INSERT INTO error_logs_rebuild ({columns}) SELECT {columns} FROM error_logs"
+    )
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'error_logs'")
+    sequence = cursor.fetchone()
+    # Indexes go with the old table and are recreated by init_db
+    cursor.execute("DROP TABLE error_logs")
+    cursor.execute("ALTER TABLE error_logs_rebuild RENAME TO error_logs")
+    if sequence:
+        # Ids of deleted rows are never handed out again
+        cursor.execute(
+            "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'error_logs'",
+            (sequence[0],),
         )
+    _backfill_content_hashes(cursor)
 
-        # Create indexes for better performance
+
+def _backfill_content_hashes(cursor, batch_size: int = 1000):
+    """Hash the logs of a rebuilt table, one batch of ids at a time"""
+    last_id = 0
+    while True:
         cursor.execute(
             """
-            CREATE INDEX IF NOT EXISTS idx_status ON error_logs(status)
+            SELECT id, zap_name, error_message FROM error_logs
+            WHERE id > ?
+            ORDER BY id
+            LIMIT ?
+        """,
+            (last_id, batch_size),
+        )
+        logs = cursor.fetchall()
+        if not logs:
+            return
+        last_id = logs[-1][0]
+        cursor.executemany(
+            "UPDATE error_logs SET content_hash = ? WHERE id = ?",
+            [
+                (content_hash(zap_name, error_message), log_id)
+                for log_id, zap_name, error_message in logs
+            ],
+        )
+
+
+def _create_error_logs(cursor):
+    """Main error logs table, upgraded in place from older layouts"""
+    cursor.execute(
         """
+        CREATE TABLE IF NOT EXISTS error_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            zap_name TEXT NOT NULL,
+            error_message TEXT NOT NULL,
+            explanation TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            status TEXT DEFAULT 'unresolved',
+            version INTEGER NOT NULL DEFAULT 0,
+            group_id INTEGER,
+            template_id INTEGER,
+            content_hash INTEGER,
+            event_ts INTEGER
         )
+    """
+    )
+    _add_column(cursor, "error_logs", "version", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(cursor, "error_logs", "group_id", "INTEGER")
+    _add_column(cursor, "error_logs", "template_id", "INTEGER")
+    _add_column(cursor, "error_logs", "content_hash", "INTEGER")
+    if _add_column(cursor, "error_logs", "event_ts", "INTEGER"):
+        # Older rows only know when they were stored
         cursor.execute(
             """
-            CREATE INDEX IF NOT EXISTS idx_zap_name ON error_logs(zap_name)
+            UPDATE error_logs
+            SET event_ts = CAST(strftime('%s', timestamp) AS INTEGER) * 1000
         """
         )
+    _drop_unique_constraint(cursor)
 
-        conn.commit()
+
+def _create_sync_state(cursor):
+    """
+    Change tracking for delta sync: a monotonically increasing change
+    version, stamped on every inserted or updated row, plus tombstones for
+    deleted rows. clear_all_logs records a reset instead of one tombstone
+    per row.
+    """
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sync_state (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    """
+    )
+    cursor.execute(
+        """
+        INSERT OR IGNORE INTO sync_state (key, value)
+        VALUES ('change_version', 0), ('reset_version', 0),
+               ('changed_at', CAST(strftime('%s', 'now') AS INTEGER)),
+               ('rules_version', 0), ('templates_version', 0)
+    """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS deleted_logs (
+            id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+    """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_deleted_logs_version
+        ON deleted_logs(version)
+    """
+    )
 
 
-def insert_error_log(
-    zap_name: str, error_message: str, explanation: Optional[str] = None
-) -> int:
-    """Insert a new error log into the database"""
-    with sqlite3.connect(DB_FILE) as conn:
-        cursor = conn.cursor()
-        try:
+def _create_error_groups(cursor):
+    """
+    Issues: occurrences of the same zap + message template, grouped by
+    fingerprint and counted incrementally as logs are inserted
+    """
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS error_groups (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            fingerprint TEXT NOT NULL UNIQUE,
+            zap_name TEXT NOT NULL,
+            template TEXT NOT NULL,
+            explanation TEXT,
+            occurrences INTEGER NOT NULL DEFAULT 0,
+            first_seen DATETIME NOT NULL,
+            last_seen DATETIME NOT NULL,
+            status TEXT NOT NULL DEFAULT 'unresolved'
+        )
+    """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_groups_last_seen
+        ON error_groups(last_seen, id)
+    """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_groups_status_last_seen
+        ON error_groups(status, last_seen, id)
+    """
+    )
+
+
+def _create_log_templates(cursor):
+    """
+    Templates mined from messages no rule explains, so the biggest
+    unexplained clusters can be given an explanation
+    """
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS log_templates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            template TEXT NOT NULL,
+            explanation TEXT,
+            size INTEGER NOT NULL DEFAULT 0,
+            first_seen DATETIME NOT NULL,
+            last_seen DATETIME NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_templates_size
+        ON log_templates(size, id)
+    """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_templates_version
+        ON log_templates(version)
+    """
+    )
+
+
+def _create_idempotency_keys(cursor):
+    """
+    Responses of webhook requests sent with an Idempotency-Key, so a
+    retried request gets the original answer instead of a new row
+    """
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key TEXT PRIMARY KEY,
+            request_hash TEXT NOT NULL,
+            status_code INTEGER NOT NULL,
+            body TEXT NOT NULL,
+            created_at INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_idempotency_created_at
+        ON idempotency_keys(created_at)
+    """
+    )
+
+
+def _create_explanation_rules(cursor):
+    """
+    Explanation rules, matched in (priority, id) order. Every change bumps
+    rules_version in sync_state so workers know to recompile.
+    """
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS explanation_rules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            pattern TEXT NOT NULL UNIQUE COLLATE NOCASE,
+            explanation TEXT NOT NULL,
+            priority INTEGER NOT NULL DEFAULT 0
+        )
+    """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_rules_priority_id
+        ON explanation_rules(priority, id)
+    """
+    )
+
+
+def _create_log_counters(cursor):
+    """
+    Running totals of error_logs, overall and per status, kept up to date
+    in the same transaction as every insert, status change and clear, so
+    stats never need a COUNT(*) over the table.
+    """
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS log_counters (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    """
+    )
+    cursor.execute("DELETE FROM log_counters")
+    cursor.execute(
+        """
+        INSERT INTO log_counters (key, value)
+        SELECT status, COUNT(*) FROM error_logs GROUP BY status
+    """
+    )
+    cursor.execute(
+        """
+        INSERT INTO log_counters (key, value)
+        SELECT 'total', COUNT(*) FROM error_logs
+    """
+    )
+
+
+def _create_log_rollups(cursor):
+    """
+    Log counts per time bucket and per zap, status or explanation, at
+    each ROLLUP_BUCKETS resolution, kept up to date by every write to
+    error_logs
+    """
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS log_rollups (
+            resolution TEXT NOT NULL,
+            dimension TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            value TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (resolution, dimension, bucket, value)
+        ) WITHOUT ROWID
+    """
+    )
+    cursor.execute("DELETE FROM log_rollups")
+    _backfill_rollups(cursor)  # defined further down
+
+
+def _create_rollup_watermark(cursor):
+    """
+    Rollups are filled in batches by roll_up_logs instead of on insert;
+    rollup_id in sync_state is the last log id counted so far. Every
+    existing log was already counted.
+    """
+    cursor.execute(
+        """
+        INSERT OR IGNORE INTO sync_state (key, value)
+        SELECT 'rollup_id', COALESCE(MAX(id), 0) FROM error_logs
+    """
+    )
+
+
+def _index(name: str, table: str, columns: str, replaces: Tuple[str, ...] = ()):
+    """Migration step building one index, dropping the ones it supersedes"""
+
+    def apply(cursor):
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table}({columns})")
+        for old in replaces:
+            cursor.execute(f"DROP INDEX IF EXISTS {old}")
+
+    return apply
+
+
+# Schema history, applied in order by init_db. Never edit or renumber a
+# released migration; add a new one. Index builds on error_logs are online:
+# on a big table they run after startup while ingestion is buffered.
+MIGRATIONS = [
+    Migration(1, "create error_logs", _create_error_logs, table="error_logs"),
+    Migration(2, "create sync_state and deleted_logs", _create_sync_state),
+    Migration(
+        3,
+        "index error_logs by version",
+        _index("idx_version", "error_logs", "version"),
+        online=True,
+        table="error_logs",
+        index="idx_version",
+    ),
+    Migration(4, "create error_groups", _create_error_groups),
+    Migration(
+        5,
+        "index error_logs by group",
+        _index("idx_group_id", "error_logs", "group_id"),
+        online=True,
+        table="error_logs",
+        index="idx_group_id",
+    ),
+    Migration(
+        6,
+        "assign groups to existing logs",
+        lambda cursor: _backfill_groups(cursor),  # defined further down
+        table="error_logs",
+    ),
+    Migration(7, "create log_templates", _create_log_templates),
+    Migration(
+        8,
+        "index error_logs by template",
+        _index("idx_template_id", "error_logs", "template_id"),
+        online=True,
+        table="error_logs",
+        index="idx_template_id",
+    ),
+    Migration(9, "create idempotency_keys", _create_idempotency_keys),
+    Migration(10, "create explanation_rules", _create_explanation_rules),
+    # The (event_ts, id) keys match the keyset pagination order in
+    # get_logs_page, so every page is a bounded index range scan, with or
+    # without a time range, status or zap filter. The old indexes are only
+    # dropped once their replacement exists.
+    Migration(
+        11,
+        "index error_logs by event time",
+        _index(
+            "idx_event_ts_id",
+            "error_logs",
+            "event_ts, id",
+            replaces=("idx_timestamp_id", "idx_timestamp"),
+        ),
+        online=True,
+        table="error_logs",
+        index="idx_event_ts_id",
+    ),
+    Migration(
+        12,
+        "index error_logs by status and event time",
+        _index(
+            "idx_status_event_ts_id",
+            "error_logs",
+            "status, event_ts, id",
+            replaces=("idx_status_timestamp_id", "idx_status"),
+        ),
+        online=True,
+        table="error_logs",
+        index="idx_status_event_ts_id",
+    ),
+    Migration(
+        13,
+        "index error_logs by zap and event time",
+        _index(
+            "idx_zap_name_event_ts_id",
+            "error_logs",
+            "zap_name, event_ts, id",
+            replaces=("idx_zap_name",),
+        ),
+        online=True,
+        table="error_logs",
+        index="idx_zap_name_event_ts_id",
+    ),
+    Migration(14, "create log_counters", _create_log_counters, table="error_logs"),
+    Migration(15, "create log_rollups", _create_log_rollups, table="error_logs"),
+    Migration(16, "roll up logs in batches", _create_rollup_watermark),
+]
+
+
+def init_db() -> List[Migration]:
+    """
+    Bring the database schema up to date. Returns the online migrations
+    left for migrations.apply_online because their tables are large.
+    """
+    return migrations.migrate(pool, MIGRATIONS)
+
+
+def plan_migrations() -> List[Dict]:
+    """Dry run: estimated cost of every pending migration"""
+    return migrations.plan(pool, MIGRATIONS)
+
+
+def _next_version(cursor) -> int:
+    """Bump and return the change version (call inside a write transaction)"""
+    cursor.execute(
+        "UPDATE sync_state SET value = value + 1 WHERE key = 'change_version'"
+    )
+    cursor.execute(
+        """
+        UPDATE sync_state SET value = CAST(strftime('%s', 'now') AS INTEGER)
+        WHERE key = 'changed_at'
+    """
+    )
+    cursor.execute("SELECT value FROM sync_state WHERE key = 'change_version'")
+    return cursor.fetchone()[0]
+
+
+def _count_logs(cursor, deltas: Dict[str, int]):
+    """Add to the log_counters totals (call inside a write transaction)"""
+    cursor.executemany(
+        """
+        INSERT INTO log_counters (key, value) VALUES (?, ?)
+        ON CONFLICT(key) DO UPDATE SET value = value + excluded.value
+    """,
+        [(key, delta) for key, delta in deltas.items() if delta],
+    )
+
+
+def _roll_up(
+    cursor, dimension: str, entries: Iterable[Tuple[int, str]], delta: int = 1
+):
+    """
+    Add `delta` to the rollups of `dimension` for each (event_ts, value),
+    at every resolution (call inside a write transaction)
+    """
+    counts: Counter = Counter()
+    for event_ts, value in entries:
+        for resolution, size in ROLLUP_BUCKETS.items():
+            counts[(resolution, event_ts - event_ts % size, value)] += delta
+    cursor.executemany(
+        """
+        INSERT INTO log_rollups (resolution, dimension, bucket, value, count)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(resolution, dimension, bucket, value)
+        DO UPDATE SET count = count + excluded.count
+    """,
+        [
+            (resolution, dimension, bucket, value, count)
+            for (resolution, bucket, value), count in counts.items()
+            if count
+        ],
+    )
+    if delta < 0:
+        cursor.executemany(
+            """
+            DELETE FROM log_rollups
+            WHERE resolution = ? AND dimension = ? AND bucket = ? AND value = ?
+              AND count <= 0
+        """,
+            [
+                (resolution, dimension, bucket, value)
+                for resolution, bucket, value in counts
+            ],
+        )
+
+
+def _utc_now() -> str:
+    """Current time in the same format as SQLite's CURRENT_TIMESTAMP"""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _ensure_groups(
+    cursor, rows: List[Tuple[str, str, Optional[str]]], seen: List[str]
+) -> List[int]:
+    """
+    Fingerprint (zap_name, error_message, explanation) rows and return the
+    group id for each one, creating groups that do not exist yet. `seen`
+    holds the time of each row, used as a new group's first/last seen.
+    """
+    group_ids: Dict[str, int] = {}
+    result = []
+    for (zap_name, error_message, explanation), when in zip(rows, seen):
+        fp, template = fingerprint(zap_name, error_message)
+        if fp not in group_ids:
             cursor.execute(
                 """
-                INSERT INTO error_logs (zap_name, error_message, explanation)
-                VALUES (?, ?, ?)
+                INSERT OR IGNORE INTO error_groups
+                    (fingerprint, zap_name, template, explanation, first_seen, last_seen)
+                VALUES (?, ?, ?, ?, ?, ?)
             """,
-                (zap_name, error_message, explanation),
+                (fp, zap_name, template, explanation, when, when),
             )
-            conn.commit()
-            return cursor.lastrowid
-        except sqlite3.IntegrityError:
-            print("⚠️ Duplicate log entry skipped")
-            return -1
+            cursor.execute("SELECT id FROM error_groups WHERE fingerprint = ?", (fp,))
+            group_ids[fp] = cursor.fetchone()[0]
+        result.append(group_ids[fp])
+    return result
 
 
-def get_all_logs(limit: int = 1000) -> List[Dict]:
-    """Retrieve all error logs from the database"""
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+def _count_occurrences(cursor, occurrences: Iterable[Tuple[int, str]]):
+    """
+    Add (group_id, seen) occurrences to their groups. A resolved issue that
+    happens again is reopened; dismissed issues stay dismissed.
+    """
+    totals: Dict[int, List] = {}
+    for group_id, seen in occurrences:
+        total = totals.setdefault(group_id, [0, seen, seen])
+        total[0] += 1
+        total[1] = min(total[1], seen)
+        total[2] = max(total[2], seen)
+    cursor.executemany(
+        """
+        UPDATE error_groups
+        SET occurrences = occurrences + ?,
+            first_seen = MIN(first_seen, ?),
+            last_seen = MAX(last_seen, ?),
+            status = CASE WHEN status = 'resolved' THEN 'unresolved' ELSE status END
+        WHERE id = ?
+    """,
+        [(count, first, last, group_id) for group_id, (count, first, last) in totals.items()],
+    )
+
+
+def _keep_dedup(version: int):
+    """
+    Call after committing `version` with a write that changes no content
+    hashes (a status or explanation): if the dedup window was current
+    before it, it still is and the next insert need not reload it.
+    Deletes and clears leave the window to be reloaded.
+    """
+    global _dedup_version
+    if _dedup_version == version - 1:
+        _dedup_version = version
+
+
+def _sync_dedup(cursor, now: float):
+    """
+    Reload the dedup window from the database unless this process made the
+    last write, in which case it already holds every recent hash.
+    """
+    global _dedup_version
+    if _dedup.window <= 0:
+        return
+    cursor.execute("SELECT value FROM sync_state WHERE key = 'change_version'")
+    if cursor.fetchone()[0] == _dedup_version:
+        return
+    # Ids grow in insert order, so walk back from the newest row until
+    # the window is covered; no index on the insert time is needed.
+    cutoff = int(now - _dedup.window)
+    cursor.execute(
+        """
+        SELECT content_hash, CAST(strftime('%s', timestamp) AS REAL)
+        FROM error_logs
+        ORDER BY id DESC
+    """
+    )
+    recent = []
+    for row_hash, stored in cursor:
+        if stored < cutoff:
+            break
+        if row_hash is not None:
+            recent.append((row_hash, stored))
+    recent.reverse()
+    _dedup.load(recent)
+
+
+def _count_template_sizes(cursor, template_ids: List[int], now: str):
+    """Add newly stored logs to their templates' sizes"""
+    sizes: Dict[int, int] = {}
+    for template_id in template_ids:
+        sizes[template_id] = sizes.get(template_id, 0) + 1
+    cursor.executemany(
+        "UPDATE log_templates SET size = size + ?, last_seen = ? WHERE id = ?",
+        [(size, now, template_id) for template_id, size in sizes.items()],
+    )
+
+
+def _backfill_groups(cursor, batch_size: int = 1000):
+    """Assign groups to logs stored before grouping existed"""
+    last_id = 0
+    while True:
+        # Walk the table by id so each batch is a range scan, whether or
+        # not idx_group_id has been built yet
         cursor.execute(
             """
-            SELECT id, zap_name, error_message, explanation, 
-                   strftime('%Y-%m-%d %H:%M:%S', timestamp) as timestamp, 
-                   status
+            SELECT id, zap_name, error_message, explanation,
+                   strftime('%Y-%m-%d %H:%M:%S', timestamp)
             FROM error_logs
-            ORDER BY timestamp DESC
+            WHERE id > ? AND group_id IS NULL
+            ORDER BY id
             LIMIT ?
         """,
-            (limit,),
+            (last_id, batch_size),
         )
-        return [dict(row) for row in cursor.fetchall()]
+        logs = cursor.fetchall()
+        if not logs:
+            return
+        last_id = logs[-1][0]
+        now = _utc_now()
+        seen = [log[4] or now for log in logs]
+        group_ids = _ensure_groups(cursor, [log[1:4] for log in logs], seen)
+        cursor.executemany(
+            "UPDATE error_logs SET group_id = ? WHERE id = ?",
+            [(group_id, log[0]) for group_id, log in zip(group_ids, logs)],
+        )
+        _count_occurrences(cursor, zip(group_ids, seen))
+
+
+def _roll_up_batch(cursor, after_id: int, batch_size: int) -> Tuple[int, int]:
+    """
+    Add the logs with ids after `after_id`, at most batch_size of them, to
+    the rollups. Returns how many were counted and the last id counted.
+    """
+    # By id rather than GROUP BY: range scans, and no sort of the table
+    cursor.execute(
+        """
+        SELECT id, event_ts, zap_name, status, explanation
+        FROM error_logs
+        WHERE id > ? AND event_ts IS NOT NULL
+        ORDER BY id
+        LIMIT ?
+    """,
+        (after_id, batch_size),
+    )
+    logs = cursor.fetchall()
+    if not logs:
+        return 0, after_id
+    _roll_up(cursor, "zap_name", [(log[1], log[2]) for log in logs])
+    _roll_up(cursor, "status", [(log[1], log[3]) for log in logs])
+    _roll_up(
+        cursor,
+        "explanation",
+        [(log[1], log[4] or DEFAULT_EXPLANATION) for log in logs],
+    )
+    return len(logs), logs[-1][0]
+
+
+def _backfill_rollups(cursor, batch_size: int = 10000):
+    """Count the logs stored before rollups existed"""
+    count, last_id = batch_size, 0
+    while count == batch_size:
+        count, last_id = _roll_up_batch(cursor, last_id, batch_size)
+
+
+def _rolled_up_to(cursor) -> int:
+    """Id of the last log counted in log_rollups"""
+    cursor.execute("SELECT value FROM sync_state WHERE key = 'rollup_id'")
+    return cursor.fetchone()[0]
+
+
+def _sync_miner(cursor):
+    """Load templates stored by other workers since this one last looked"""
+    global _miner_version
+    cursor.execute("SELECT value FROM sync_state WHERE key = 'templates_version'")
+    version = cursor.fetchone()[0]
+    if version != _miner_version:
+        cursor.execute(
+            "SELECT id, template FROM log_templates WHERE version > ?",
+            (_miner_version,),
+        )
+        _miner.load(cursor.fetchall())
+        _miner_version = version
+
+
+def _mine_templates(
+    cursor, rows: List[Tuple[str, str, Optional[str]]], now: str
+) -> Tuple[List[Optional[int]], List[Optional[str]]]:
+    """
+    Feed unexplained rows to the template miner and store new or widened
+    templates. Returns each row's template id (None for explained rows)
+    and explanation, filled in from its template where one was attached.
+    """
+    global _miner_version
+    _sync_miner(cursor)
+    template_ids: List[Optional[int]] = []
+    changed: Dict[int, str] = {}
+    for _, error_message, explanation in rows:
+        if explanation not in (None, DEFAULT_EXPLANATION):
+            template_ids.append(None)
+            continue
+        template, is_changed = _miner.add(error_message)
+        if template.id is None:
+            cursor.execute(
+                """
+                INSERT INTO log_templates (template, first_seen, last_seen)
+                VALUES (?, ?, ?)
+            """,
+                (template.text, now, now),
+            )
+            template.id = cursor.lastrowid
+            _miner.remember(template)
+        if is_changed:
+            changed[template.id] = template.text
+        template_ids.append(template.id)
+
+    if changed:
+        cursor.execute(
+            """
+            UPDATE sync_state SET value = value + 1 WHERE key = 'templates_version'
+        """
+        )
+        cursor.execute("SELECT value FROM sync_state WHERE key = 'templates_version'")
+        _miner_version = cursor.fetchone()[0]
+        cursor.executemany(
+            "UPDATE log_templates SET template = ?, version = ? WHERE id = ?",
+            [(text, _miner_version, i) for i, text in changed.items()],
+        )
+
+    attached = {}
+    used = sorted({i for i in template_ids if i is not None})
+    if used:
+        cursor.execute(
+            f"""
+            SELECT id, explanation FROM log_templates
+            WHERE explanation IS NOT NULL AND id IN ({",".join("?" * len(used))})
+        """,
+            used,
+        )
+        attached = dict(cursor.fetchall())
+    explanations = [
+        attached.get(template_id, explanation)
+        for (_, _, explanation), template_id in zip(rows, template_ids)
+    ]
+    return template_ids, explanations
+
+
+def _reset_miner():
+    """Forget the in-memory templates; they are reloaded on the next write"""
+    global _miner_version
+    _miner.reset()
+    _miner_version = 0
+
+
+def insert_error_logs(
+    rows: List[Tuple[str, str, Optional[str], Optional[int]]]
+) -> List[int]:
+    """
+    Insert many (zap_name, error_message, explanation, event_ts) rows in one
+    transaction; event_ts (epoch ms) defaults to now. Returns the new id for
+    each row, or -1 where the row was a duplicate (same zap, message and,
+    if one was sent, event time within the dedup window).
+    """
+    global _dedup_version
+    try:
+        with pool.writer() as conn:
+            cursor = conn.cursor()
+            now_ts = time.time()
+            _sync_dedup(cursor, now_ts)
+            version = _next_version(cursor)
+
+            hashes, fresh, event_times = [], [], []
+            for zap_name, error_message, explanation, event_ts in rows:
+                row_hash = content_hash(zap_name, error_message, event_ts)
+                duplicate = _dedup.window > 0 and _dedup.is_duplicate(row_hash, now_ts)
+                if not duplicate:
+                    _dedup.add(row_hash, now_ts)
+                    fresh.append((zap_name, error_message, explanation))
+                    event_times.append(
+                        int(now_ts * 1000) if event_ts is None else event_ts
+                    )
+                hashes.append(None if duplicate else row_hash)
+
+            now = _utc_now()
+            group_ids = _ensure_groups(cursor, fresh, [now] * len(fresh))
+            template_ids, explanations = _mine_templates(cursor, fresh, now)
+            new_ids = []
+            for (zap_name, error_message, _), explanation, group_id, template_id, row_hash, event_ts in zip(
+                fresh,
+                explanations,
+                group_ids,
+                template_ids,
+                [h for h in hashes if h is not None],
+                event_times,
+            ):
+                cursor.execute(
+                    """
+                    INSERT INTO error_logs
+                        (zap_name, error_message, explanation, version,
+                         group_id, template_id, content_hash, event_ts)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                    (
+                        zap_name,
+                        error_message,
+                        explanation,
+                        version,
+                        group_id,
+                        template_id,
+                        row_hash,
+                        event_ts,
+                    ),
+                )
+                new_ids.append(cursor.lastrowid)
+            _count_occurrences(cursor, [(group_id, now) for group_id in group_ids])
+            _count_logs(cursor, {"total": len(new_ids), "unresolved": len(new_ids)})
+            _count_template_sizes(cursor, [t for t in template_ids if t], now)
+    except Exception:
+        # The miner and dedup window may hold rows from the rolled back
+        # transaction
+        _reset_miner()
+        _dedup_version = None
+        raise
+    _dedup_version = version
+    new_ids.reverse()
+    return [-1 if row_hash is None else new_ids.pop() for row_hash in hashes]
+
+
+def _log_filters(
+    status: Optional[str],
+    start: Optional[int],
+    end: Optional[int],
+    zap_name: Optional[str] = None,
+) -> Tuple[List[str], List]:
+    """
+    WHERE terms for a status or zap name and an event time range
+    [start, end) in epoch ms
+    """
+    where, params = [], []
+    if status:
+        where.append("status = ?")
+        params.append(status)
+    if zap_name:
+        where.append("zap_name = ?")
+        params.append(zap_name)
+    if start is not None:
+        where.append("event_ts >= ?")
+        params.append(start)
+    if end is not None:
+        where.append("event_ts < ?")
+        params.append(end)
+    return where, params
+
+
+def iter_logs(
+    status: Optional[str] = None,
+    batch_size: int = 500,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    zap_name: Optional[str] = None,
+) -> Iterator[List[Dict]]:
+    """
+    Yield every log (newest first, optionally filtered by status, zap and
+    event time range) in batches of `batch_size`, fetched incrementally
+    from one open cursor so memory use does not depend on the table size.
+    """
+    where, params = _log_filters(status, start, end, zap_name)
+    conn = pool.connect()
+    try:
+        cursor = conn.execute(
+            f"""
+            SELECT {LOG_COLUMNS}
+            FROM error_logs
+            {"WHERE " + " AND ".join(where) if where else ""}
+            ORDER BY event_ts DESC, id DESC
+        """,
+            params,
+        )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [dict(row) for row in rows]
+    finally:
+        conn.close()
+
+
+def encode_cursor(direction: str, row: Dict) -> str:
+    """Build an opaque page cursor pointing just past `row`"""
+    raw = json.dumps([direction, row["event_ts"], row["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int, int]:
+    """Reverse encode_cursor; raises ValueError for a malformed cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        direction, event_ts, log_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if (
+        direction not in ("next", "prev")
+        or not isinstance(event_ts, int)
+        or not isinstance(log_id, int)
+    ):
+        raise ValueError("Invalid cursor")
+    return direction, event_ts, log_id
+
+
+def get_logs_page(
+    status: Optional[str] = None,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    zap_name: Optional[str] = None,
+) -> Tuple[List[Dict], Optional[str], Optional[str]]:
+    """
+    Get one page of logs, newest first, using keyset pagination on
+    (event_ts, id), optionally limited to one zap and to the event time
+    range [start, end) in epoch ms. Returns (logs, next_cursor,
+    prev_cursor); a cursor is None when there is no page in that direction.
+    """
+    direction, key = "next", None
+    if cursor:
+        direction, event_ts, log_id = decode_cursor(cursor)
+        key = (event_ts, log_id)
+
+    where, params = _log_filters(status, start, end, zap_name)
+    if key and direction == "next":
+        where.append("(event_ts, id) < (?, ?)")
+        params.extend(key)
+    elif key:
+        where.append("(event_ts, id) > (?, ?)")
+        params.extend(key)
+    order = "DESC" if direction == "next" else "ASC"
+
+    with pool.reader() as conn:
+        rows = conn.execute(
+            f"""
+            SELECT {LOG_COLUMNS}
+            FROM error_logs
+            {"WHERE " + " AND ".join(where) if where else ""}
+            ORDER BY event_ts {order}, id {order}
+            LIMIT ?
+        """,
+            params + [limit + 1],
+        ).fetchall()
+
+    logs = [dict(row) for row in rows[:limit]]
+    has_more = len(rows) > limit
+    if direction == "prev":
+        logs.reverse()
+
+    if not logs:
+        return logs, None, None
+    # Going forward there is always a previous page once we have moved off
+    # the first one, and vice versa.
+    has_next = has_more if direction == "next" else True
+    has_prev = key is not None if direction == "next" else has_more
+    next_cursor = encode_cursor("next", logs[-1]) if has_next else None
+    prev_cursor = encode_cursor("prev", logs[0]) if has_prev else None
+    return logs, next_cursor, prev_cursor
 
 
 def update_log_status(log_id: int, new_status: str) -> bool:
@@ -87,43 +1098,855 @@ def update_log_status(log_id: int, new_status: str) -> bool:
     if new_status not in valid_statuses:
         raise ValueError(f"Invalid status. Must be one of: {valid_statuses}")
 
-    with sqlite3.connect(DB_FILE) as conn:
+    with pool.writer() as conn:
         cursor = conn.cursor()
+        cursor.execute(
+            "SELECT status, event_ts FROM error_logs WHERE id = ?", (log_id,)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return False
+        version = _next_version(cursor)
         cursor.execute(
             """
             UPDATE error_logs 
-            SET status = ? 
+            SET status = ?, version = ?
             WHERE id = ?
         """,
-            (new_status, log_id),
+            (new_status, version, log_id),
+        )
+        old_status, event_ts = row
+        if old_status != new_status:
+            _count_logs(cursor, {old_status: -1, new_status: 1})
+            # Logs not rolled up yet are counted with their new status
+            if event_ts is not None and log_id <= _rolled_up_to(cursor):
+                _roll_up(cursor, "status", [(event_ts, old_status)], -1)
+                _roll_up(cursor, "status", [(event_ts, new_status)])
+    _keep_dedup(version)
+    return True
+
+
+def clear_all_logs(archive: bool = False) -> Dict:
+    """
+    Delete all logs by swapping in a new, empty error_logs table. The old
+    table is renamed instead of emptied row by row, so the write lock is
+    held for a few schema changes whatever its size; its indexes are
+    dropped and rebuilt empty on the new table. With archive the old rows
+    are kept as an archived_logs_<version> table, otherwise it becomes a
+    discarded_logs_<version> table that purge_discarded_logs empties in
+    the background. Returns {"deleted", "archive"}.
+    """
+    with pool.writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT value FROM log_counters WHERE key = 'total'")
+        row = cursor.fetchone()
+        count = row[0] if row else 0
+        # One reset marker instead of a tombstone per row; clients that
+        # synced before it have to reload.
+        version = _next_version(cursor)
+        cursor.execute(
+            "UPDATE sync_state SET value = ? WHERE key = 'reset_version'", (version,)
+        )
+        old_table = f"{ARCHIVE_PREFIX if archive else DISCARD_PREFIX}{version}"
+        cursor.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'error_logs'"
+        )
+        table_sql = cursor.fetchone()[0]
+        cursor.execute(
+            """
+            SELECT name, sql FROM sqlite_master
+            WHERE type = 'index' AND tbl_name = 'error_logs' AND sql IS NOT NULL
+        """
+        )
+        indexes = cursor.fetchall()
+        # Index names are global, so they cannot stay on the old table
+        for name, _ in indexes:
+            cursor.execute(f"DROP INDEX {name}")
+        cursor.execute(f"ALTER TABLE error_logs RENAME TO {old_table}")
+        cursor.execute(table_sql)
+        for _, sql in indexes:
+            cursor.execute(sql)
+        # Ids are never handed out again: sync, tombstones and the rollup
+        # watermark all rely on that
+        cursor.execute(
+            """
+            INSERT INTO sqlite_sequence (name, seq)
+            SELECT 'error_logs', seq FROM sqlite_sequence WHERE name = ?
+        """,
+            (old_table,),
+        )
+        cursor.execute("DELETE FROM deleted_logs")
+        cursor.execute("DELETE FROM error_groups")
+        # Learned templates (and their explanations) are kept
+        cursor.execute("UPDATE log_templates SET size = 0")
+        cursor.execute("UPDATE log_counters SET value = 0")
+        cursor.execute("DELETE FROM log_rollups")
+        return {"deleted": count, "archive": old_table if archive else None}
+
+
+def get_log_archives() -> List[Dict]:
+    """Tables kept by clear_all_logs(archive=True), oldest first"""
+    with pool.reader() as conn:
+        names = [
+            row[0]
+            for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB ?",
+                (f"{ARCHIVE_PREFIX}*",),
+            )
+        ]
+        archives = []
+        for name in sorted(names, key=lambda name: int(name[len(ARCHIVE_PREFIX):])):
+            # Rowid range instead of COUNT(*), which would read the table
+            low, high = conn.execute(
+                f"SELECT MIN(rowid), MAX(rowid) FROM {name}"
+            ).fetchone()
+            archives.append(
+                {"name": name, "rows": 0 if low is None else high - low + 1}
+            )
+        return archives
+
+
+def discard_log_archive(name: str) -> bool:
+    """Hand an archive over to purge_discarded_logs; False if there is none"""
+    if not name.startswith(ARCHIVE_PREFIX):
+        return False
+    with pool.writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+        )
+        if cursor.fetchone() is None:
+            return False
+        discarded = DISCARD_PREFIX + name[len(ARCHIVE_PREFIX):]
+        cursor.execute(f"ALTER TABLE {name} RENAME TO {discarded}")
+        return True
+
+
+def purge_discarded_logs(limit: int = 5000) -> Optional[int]:
+    """
+    Delete up to `limit` rows of a table left by clear_all_logs in one
+    transaction, dropping the table once it is empty. Returns the number
+    of rows deleted, or None if there is nothing left to purge.
+    """
+    with pool.writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT name FROM sqlite_master
+            WHERE type = 'table' AND name GLOB ?
+            LIMIT 1
+        """,
+            (f"{DISCARD_PREFIX}*",),
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        name = row[0]
+        # No indexes are left on it, so these deletes only touch the table
+        cursor.execute(
+            f"DELETE FROM {name} WHERE rowid IN (SELECT rowid FROM {name} LIMIT ?)",
+            (limit,),
+        )
+        count = cursor.rowcount
+        if count < limit:
+            cursor.execute(f"DROP TABLE {name}")
+        return count
+
+
+def _delete_logs(cursor, ids: List[int]) -> int:
+    """
+    Delete logs by id inside a write transaction, leaving a tombstone for
+    each so synced clients drop them, and keep log_counters exact. Rollups,
+    groups and template sizes are history and keep counting them.
+    """
+    if not ids:
+        return 0
+    placeholders = ",".join("?" * len(ids))
+    cursor.execute(
+        f"""
+        SELECT status, COUNT(*) FROM error_logs
+        WHERE id IN ({placeholders})
+        GROUP BY status
+    """,
+        ids,
+    )
+    by_status = dict(cursor.fetchall())
+    cursor.execute(f"DELETE FROM error_logs WHERE id IN ({placeholders})", ids)
+    count = cursor.rowcount
+    version = _next_version(cursor)
+    cursor.executemany(
+        "INSERT OR REPLACE INTO deleted_logs (id, version) VALUES (?, ?)",
+        [(log_id, version) for log_id in ids],
+    )
+    _count_logs(
+        cursor,
+        {"total": -count, **{status: -n for status, n in by_status.items()}},
+    )
+    return count
+
+
+def delete_expired_logs(
+    before: int, status: Optional[str] = None, limit: int = 500
+) -> int:
+    """
+    Delete up to `limit` of the oldest logs with an event time before
+    `before` (epoch ms), optionally only those with `status`, in one
+    transaction. Logs not rolled up yet are left for a later pass. Returns
+    the number deleted.
+    """
+    with pool.writer() as conn:
+        cursor = conn.cursor()
+        conditions, params = ["event_ts < ?", "id <= ?"], [before, _rolled_up_to(cursor)]
+        if status is not None:
+            conditions.insert(0, "status = ?")
+            params.insert(0, status)
+        cursor.execute(
+            f"""
+            SELECT id FROM error_logs
+            WHERE {" AND ".join(conditions)}
+            ORDER BY event_ts, id
+            LIMIT ?
+        """,
+            (*params, limit),
+        )
+        return _delete_logs(cursor, [row[0] for row in cursor.fetchall()])
+
+
+def get_excess_cut(zap_name: str, keep: int) -> Optional[Tuple[int, int]]:
+    """
+    (event_ts, id) of a zap's keep-th newest log by event time; every log
+    before it is beyond the limit. None if the zap has no more than `keep`.
+    """
+    with pool.reader() as conn:
+        row = conn.execute(
+            """
+            SELECT event_ts, id FROM error_logs
+            WHERE zap_name = ?
+            ORDER BY event_ts DESC, id DESC
+            LIMIT 1 OFFSET ?
+        """,
+            (zap_name, keep - 1),
+        ).fetchone()
+        return None if row is None else (row[0], row[1])
+
+
+def delete_excess_logs(zap_name: str, cut: Tuple[int, int], limit: int = 500) -> int:
+    """
+    Delete up to `limit` logs of a zap before `cut` (from get_excess_cut),
+    oldest first, in one transaction. Returns the number deleted. New logs
+    only move the real cut forward, so one cut serves every batch.
+    """
+    with pool.writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT id FROM error_logs
+            WHERE zap_name = ? AND (event_ts, id) < (?, ?) AND id <= ?
+            ORDER BY event_ts, id
+            LIMIT ?
+        """,
+            (zap_name, cut[0], cut[1], _rolled_up_to(cursor), limit),
         )
+        return _delete_logs(cursor, [row[0] for row in cursor.fetchall()])
+
+
+def get_zap_names() -> List[str]:
+    """Distinct zap names, one index lookup each instead of a table scan"""
+    names: List[str] = []
+    with pool.reader() as conn:
+        while True:
+            row = conn.execute(
+                "SELECT MIN(zap_name) FROM error_logs WHERE zap_name > ?",
+                (names[-1] if names else "",),
+            ).fetchone()
+            if row[0] is None:
+                return names
+            names.append(row[0])
+
+
+def prune_tombstones(keep: int) -> int:
+    """
+    Delete all but the newest `keep` tombstones. Clients synced before the
+    newest pruned one can no longer be sent its deletion, so they are
+    asked to reload. Returns the number deleted.
+    """
+    with pool.writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT version FROM deleted_logs ORDER BY version DESC LIMIT 1 OFFSET ?",
+            (keep,),
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return 0
+        cursor.execute("DELETE FROM deleted_logs WHERE version <= ?", (row[0],))
+        count = cursor.rowcount
+        cursor.execute(
+            """
+            UPDATE sync_state SET value = MAX(value, ?)
+            WHERE key = 'reset_version'
+        """,
+            (row[0],),
+        )
+        return count
+
+
+def incremental_vacuum(pages: int) -> int:
+    """
+    Return up to `pages` free pages to the file system, in one transaction.
+    Only does anything on databases with auto_vacuum=INCREMENTAL. Returns
+    the number of free pages left.
+    """
+    with pool.writer() as conn:
+        # The pragma frees one page per step, and execute() only steps a
+        # statement without result columns once; executescript runs it to
+        # completion, in its own transaction
+        conn.commit()
+        conn.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+        return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+def enable_incremental_vacuum() -> bool:
+    """
+    Switch an existing database to auto_vacuum=INCREMENTAL. Rewrites the
+    whole file with VACUUM, so run it in a maintenance window. Returns
+    False if it was already enabled.
+    """
+    with pool.writer() as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        # VACUUM cannot run inside a transaction
         conn.commit()
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return True
+
+
+def get_stats() -> Dict:
+    """
+    Log totals, overall and per status, read from log_counters: a few
+    primary key rows, so the cost does not grow with the table
+    """
+    with pool.reader() as conn:
+        # One read transaction so the version matches the counters
+        conn.execute("BEGIN")
+        try:
+            stats = _read_stats(conn)
+            stats["version"] = conn.execute(
+                "SELECT value FROM sync_state WHERE key = 'change_version'"
+            ).fetchone()[0]
+        finally:
+            conn.execute("COMMIT")
+    return stats
+
+
+def _read_stats(conn) -> Dict:
+    counters = dict(conn.execute("SELECT key, value FROM log_counters").fetchall())
+    return {
+        key: counters.get(key, 0)
+        for key in ("total", "unresolved", "resolved", "dismissed")
+    }
+
+
+def has_logs_to_roll_up() -> bool:
+    """Whether logs were inserted since the last roll_up_logs, from a reader"""
+    with pool.reader() as conn:
+        row = conn.execute(
+            """
+            SELECT (SELECT MAX(id) FROM error_logs)
+                > (SELECT value FROM sync_state WHERE key = 'rollup_id')
+        """
+        ).fetchone()
+        return bool(row[0])
+
+
+def roll_up_logs(batch_size: int = 5000) -> int:
+    """
+    Count up to batch_size logs inserted since the last call into
+    log_rollups, in one transaction. Returns how many were counted.
+    """
+    with pool.writer() as conn:
+        cursor = conn.cursor()
+        count, last_id = _roll_up_batch(cursor, _rolled_up_to(cursor), batch_size)
+        if count:
+            cursor.execute(
+                "UPDATE sync_state SET value = ? WHERE key = 'rollup_id'", (last_id,)
+            )
+        return count
+
+
+def prune_rollups(cutoffs: Dict[str, int], limit: int = 5000) -> int:
+    """
+    Delete up to `limit` rollup buckets per resolution that start before
+    its cutoff (epoch ms), in one transaction. Resolutions missing from
+    `cutoffs` are kept forever. Returns the number of buckets deleted.
+    """
+    deleted = 0
+    with pool.writer() as conn:
+        cursor = conn.cursor()
+        for resolution, cutoff in cutoffs.items():
+            for dimension in ROLLUP_DIMENSIONS:
+                cursor.execute(
+                    """
+                    DELETE FROM log_rollups
+                    WHERE (resolution, dimension, bucket, value) IN (
+                        SELECT resolution, dimension, bucket, value
+                        FROM log_rollups
+                        WHERE resolution = ? AND dimension = ? AND bucket < ?
+                        LIMIT ?
+                    )
+                """,
+                    (resolution, dimension, cutoff, limit - deleted),
+                )
+                deleted += cursor.rowcount
+                if deleted >= limit:
+                    return deleted
+    return deleted
+
+
+def get_aggregates(
+    group_by: str,
+    bucket: str,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+) -> Dict:
+    """
+    Log counts per `bucket` ("1m", "1h" or "1d") and per zap_name, status
+    or explanation, for event times in [start, end) (epoch ms; the last
+    AGGREGATE_DEFAULT_BUCKETS buckets by default). Read from log_rollups,
+    so the cost depends on the buckets returned, not on the number of logs.
+    Raises ValueError for an unknown group_by or bucket, or a range of more
+    than AGGREGATE_MAX_BUCKETS buckets.
+    """
+    if group_by not in ROLLUP_DIMENSIONS:
+        raise ValueError(f"Invalid group_by. Must be one of: {list(ROLLUP_DIMENSIONS)}")
+    if bucket not in ROLLUP_BUCKETS:
+        raise ValueError(f"Invalid bucket. Must be one of: {list(ROLLUP_BUCKETS)}")
+    size = ROLLUP_BUCKETS[bucket]
+    if end is None:
+        end = int(time.time() * 1000)
+    if start is None:
+        start = end - size * AGGREGATE_DEFAULT_BUCKETS
+    start -= start % size
+    if end - start > size * AGGREGATE_MAX_BUCKETS:
+        raise ValueError(
+            f"Range too large: at most {AGGREGATE_MAX_BUCKETS} buckets of {bucket}"
+        )
+
+    with pool.reader() as conn:
+        rows = conn.execute(
+            """
+            SELECT bucket, value, count FROM log_rollups
+            WHERE resolution = ? AND dimension = ? AND bucket >= ? AND bucket < ?
+            ORDER BY bucket, value
+        """,
+            (bucket, group_by, start, end),
+        ).fetchall()
+
+    buckets: List[Dict] = []
+    totals: Counter = Counter()
+    for bucket_start, value, count in rows:
+        if not buckets or buckets[-1]["start"] != bucket_start:
+            buckets.append(
+                {
+                    "start": bucket_start,
+                    "timestamp": datetime.fromtimestamp(
+                        bucket_start / 1000, timezone.utc
+                    ).strftime("%Y-%m-%d %H:%M:%S"),
+                    "counts": {},
+                }
+            )
+        buckets[-1]["counts"][value] = count
+        totals[value] += count
+    return {
+        "group_by": group_by,
+        "bucket": bucket,
+        "from": start,
+        "to": end,
+        "totals": dict(totals.most_common()),
+        "buckets": buckets,
+    }
+
+
+def get_change_version() -> int:
+    """Current change version; every write to error_logs increases it"""
+    with pool.reader() as conn:
+        row = conn.execute(
+            "SELECT value FROM sync_state WHERE key = 'change_version'"
+        ).fetchone()
+        return row[0]
+
+
+def get_sync_state() -> Dict:
+    """
+    Change version and last change time (epoch seconds) of error_logs.
+    Reads one tiny table, so it is cheap enough to run before every listing
+    to answer conditional requests.
+    """
+    with pool.reader() as conn:
+        state = dict(conn.execute("SELECT key, value FROM sync_state").fetchall())
+        return {"version": state["change_version"], "changed_at": state["changed_at"]}
+
+
+def get_changes(since: int, limit: int = 1000) -> Dict:
+    """
+    Get logs inserted or updated, and ids deleted, after change version
+    `since`, plus the totals of get_stats as of the same version. When the
+    client is too far behind (a clear happened, or more than `limit` rows
+    changed) the result has reset=True and the client should reload the
+    full list instead.
+    """
+    with pool.reader() as conn:
+        # One read transaction so the version matches the rows returned
+        conn.execute("BEGIN")
+        try:
+            state = dict(conn.execute("SELECT key, value FROM sync_state").fetchall())
+            result = {
+                "version": state["change_version"],
+                "reset": False,
+                "upserts": [],
+                "deleted": [],
+                "stats": _read_stats(conn),
+            }
+            if since < state["reset_version"] or since > state["change_version"]:
+                result["reset"] = True
+                return result
+
+            upserts = conn.execute(
+                f"""
+                SELECT {LOG_COLUMNS}
+                FROM error_logs
+                WHERE version > ?
+                ORDER BY version
+                LIMIT ?
+            """,
+                (since, limit + 1),
+            ).fetchall()
+            deleted = conn.execute(
+                """
+                SELECT id FROM deleted_logs
+                WHERE version > ?
+                ORDER BY version
+                LIMIT ?
+            """,
+                (since, limit + 1),
+            ).fetchall()
+        finally:
+            conn.execute("COMMIT")
+
+    if len(upserts) + len(deleted) > limit:
+        result["reset"] = True
+        return result
+    result["upserts"] = [dict(row) for row in upserts]
+    result["deleted"] = [row[0] for row in deleted]
+    return result
+
+
+GROUP_COLUMNS = """
+    id, fingerprint, zap_name, template, explanation, occurrences,
+    first_seen, last_seen, status
+"""
+
+
+def get_error_groups(status: Optional[str] = None, limit: int = 100) -> List[Dict]:
+    """Get error groups, most recently seen first, optionally filtered by status"""
+    where, params = "", []
+    if status:
+        where, params = "WHERE status = ?", [status]
+    with pool.reader() as conn:
+        rows = conn.execute(
+            f"""
+            SELECT {GROUP_COLUMNS}
+            FROM error_groups
+            {where}
+            ORDER BY last_seen DESC, id DESC
+            LIMIT ?
+        """,
+            params + [limit],
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+
+def get_error_group(group_id: int, samples: int = 20) -> Optional[Dict]:
+    """Get one error group with its most recent occurrences"""
+    with pool.reader() as conn:
+        row = conn.execute(
+            f"SELECT {GROUP_COLUMNS} FROM error_groups WHERE id = ?", (group_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        group = dict(row)
+        group["recent"] = [
+            dict(log)
+            for log in conn.execute(
+                f"""
+                SELECT {LOG_COLUMNS}
+                FROM error_logs
+                WHERE group_id = ?
+                ORDER BY id DESC
+                LIMIT ?
+            """,
+                (group_id, samples),
+            ).fetchall()
+        ]
+        return group
+
+
+def update_group_status(group_id: int, new_status: str) -> bool:
+    """Update the status of an error group"""
+    valid_statuses = ["unresolved", "resolved", "dismissed"]
+    if new_status not in valid_statuses:
+        raise ValueError(f"Invalid status. Must be one of: {valid_statuses}")
+
+    with pool.writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE error_groups SET status = ? WHERE id = ?", (new_status, group_id)
+        )
         return cursor.rowcount > 0
 
 
-def clear_all_logs() -> int:
-    """Delete all logs from the database"""
-    with sqlite3.connect(DB_FILE) as conn:
+def get_log_templates(limit: int = 100, unexplained: bool = False) -> List[Dict]:
+    """Mined templates of unexplained messages, largest cluster first"""
+    where = "WHERE explanation IS NULL" if unexplained else ""
+    with pool.reader() as conn:
+        rows = conn.execute(
+            f"""
+            SELECT id, template, explanation, size, first_seen, last_seen
+            FROM log_templates
+            {where}
+            ORDER BY size DESC, id DESC
+            LIMIT ?
+        """,
+            (limit,),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+
+def set_template_explanation(template_id: int, explanation: str) -> Optional[int]:
+    """
+    Attach an explanation to a mined template. New messages matching it
+    get the explanation, and so do its stored logs that had none. Returns
+    the number of logs updated, or None if the template does not exist.
+    """
+    with pool.writer() as conn:
         cursor = conn.cursor()
-        cursor.execute("DELETE FROM error_logs")
-        conn.commit()
-        return cursor.rowcount
+        cursor.execute(
+            "SELECT explanation FROM log_templates WHERE id = ?", (template_id,)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        previous = row[0] or DEFAULT_EXPLANATION
+        cursor.execute(
+            "UPDATE log_templates SET explanation = ? WHERE id = ?",
+            (explanation, template_id),
+        )
+        # Move the relabelled logs already rolled up to their new explanation
+        cursor.execute(
+            """
+            SELECT event_ts, explanation FROM error_logs
+            WHERE template_id = ? AND explanation IN (?, ?)
+              AND id <= ? AND event_ts IS NOT NULL
+        """,
+            (template_id, DEFAULT_EXPLANATION, previous, _rolled_up_to(cursor)),
+        )
+        relabelled = cursor.fetchall()
+        _roll_up(cursor, "explanation", relabelled, -1)
+        _roll_up(cursor, "explanation", [(ts, explanation) for ts, _ in relabelled])
+        version = _next_version(cursor)
+        cursor.execute(
+            """
+            UPDATE error_logs SET explanation = ?, version = ?
+            WHERE template_id = ? AND explanation IN (?, ?)
+        """,
+            (explanation, version, template_id, DEFAULT_EXPLANATION, previous),
+        )
+        updated = cursor.rowcount
+    _keep_dedup(version)
+    return updated
 
 
-def get_logs_by_status(status: str) -> List[Dict]:
-    """Get logs filtered by status"""
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
+def get_idempotency_key(key: str, not_before: int) -> Optional[Dict]:
+    """Stored response for an idempotency key created at or after not_before"""
+    with pool.reader() as conn:
+        row = conn.execute(
+            """
+            SELECT key, request_hash, status_code, body, created_at
+            FROM idempotency_keys
+            WHERE key = ? AND created_at >= ?
+        """,
+            (key, not_before),
+        ).fetchone()
+    if row is None:
+        return None
+    entry = dict(row)
+    entry["body"] = json.loads(entry["body"])
+    return entry
+
+
+def save_idempotency_keys(entries: List[Dict], expire_before: int) -> int:
+    """
+    Store responses for idempotency keys and drop keys created before
+    expire_before. Returns the number of expired keys removed.
+    """
+    with pool.writer() as conn:
         cursor = conn.cursor()
+        cursor.executemany(
+            """
+            INSERT OR REPLACE INTO idempotency_keys
+                (key, request_hash, status_code, body, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        """,
+            [
+                (
+                    entry["key"],
+                    entry["request_hash"],
+                    entry["status_code"],
+                    json.dumps(entry["body"]),
+                    entry["created_at"],
+                )
+                for entry in entries
+            ],
+        )
         cursor.execute(
+            "DELETE FROM idempotency_keys WHERE created_at < ?", (expire_before,)
+        )
+        return cursor.rowcount
+
+
+def _bump_rules_version(cursor) -> int:
+    cursor.execute(
+        "UPDATE sync_state SET value = value + 1 WHERE key = 'rules_version'"
+    )
+    cursor.execute("SELECT value FROM sync_state WHERE key = 'rules_version'")
+    return cursor.fetchone()[0]
+
+
+def seed_explanation_rules(rules: List[Tuple[str, str]]) -> bool:
+    """
+    Insert the built-in rules, in order, if the rule set has never been
+    touched. Returns True if it seeded anything.
+    """
+    with pool.writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT value FROM sync_state WHERE key = 'rules_version'")
+        if cursor.fetchone()[0] != 0:
+            return False
+        cursor.executemany(
             """
-            SELECT id, zap_name, error_message, explanation, 
-                   strftime('%Y-%m-%d %H:%M:%S', timestamp) as timestamp, 
-                   status
-            FROM error_logs
-            WHERE status = ?
-            ORDER BY timestamp DESC
+            INSERT OR IGNORE INTO explanation_rules (pattern, explanation, priority)
+            VALUES (?, ?, ?)
         """,
-            (status,),
+            [(pattern, explanation, i) for i, (pattern, explanation) in enumerate(rules)],
+        )
+        _bump_rules_version(cursor)
+        return True
+
+
+def get_rules_version() -> int:
+    """Current version of the explanation rule set"""
+    with pool.reader() as conn:
+        row = conn.execute(
+            "SELECT value FROM sync_state WHERE key = 'rules_version'"
+        ).fetchone()
+        return row[0]
+
+
+def get_explanation_rules() -> Dict:
+    """All explanation rules in match order, with the rule set version"""
+    with pool.reader() as conn:
+        conn.execute("BEGIN")
+        try:
+            version = conn.execute(
+                "SELECT value FROM sync_state WHERE key = 'rules_version'"
+            ).fetchone()[0]
+            rules = conn.execute(
+                """
+                SELECT id, pattern, explanation, priority
+                FROM explanation_rules
+                ORDER BY priority, id
+            """
+            ).fetchall()
+        finally:
+            conn.execute("COMMIT")
+    return {"version": version, "rules": [dict(row) for row in rules]}
+
+
+def create_explanation_rule(
+    pattern: str, explanation: str, priority: Optional[int] = None
+) -> Optional[Dict]:
+    """
+    Add a rule; without a priority it goes after all existing rules.
+    Returns the new rule, or None if the pattern already exists.
+    """
+    try:
+        with pool.writer() as conn:
+            cursor = conn.cursor()
+            if priority is None:
+                cursor.execute(
+                    "SELECT COALESCE(MAX(priority) + 1, 0) FROM explanation_rules"
+                )
+                priority = cursor.fetchone()[0]
+            cursor.execute(
+                """
+                INSERT INTO explanation_rules (pattern, explanation, priority)
+                VALUES (?, ?, ?)
+            """,
+                (pattern, explanation, priority),
+            )
+            rule_id = cursor.lastrowid
+            _bump_rules_version(cursor)
+    except sqlite3.IntegrityError:
+        return None
+    return {"id": rule_id, "pattern": pattern, "explanation": explanation, "priority": priority}
+
+
+def update_explanation_rule(rule_id: int, **changes) -> Optional[Dict]:
+    """
+    Update any of pattern, explanation and priority of a rule. Returns the
+    updated rule or None if it does not exist; raises sqlite3.IntegrityError
+    if the new pattern is taken.
+    """
+    fields = {k: v for k, v in changes.items() if v is not None}
+    unknown = set(fields) - {"pattern", "explanation", "priority"}
+    if unknown:
+        raise ValueError(f"Unknown rule fields: {sorted(unknown)}")
+
+    with pool.writer() as conn:
+        cursor = conn.cursor()
+        if fields:
+            assignments = ", ".join(f"{name} = ?" for name in fields)
+            cursor.execute(
+                f"UPDATE explanation_rules SET {assignments} WHERE id = ?",
+                [*fields.values(), rule_id],
+            )
+            if cursor.rowcount:
+                _bump_rules_version(cursor)
+        cursor.execute(
+            "SELECT id, pattern, explanation, priority FROM explanation_rules WHERE id = ?",
+            (rule_id,),
         )
-        return [dict(row) for row in cursor.fetchall()]
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+
+def delete_explanation_rule(rule_id: int) -> bool:
+    """Delete a rule; returns False if it did not exist"""
+    with pool.writer() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM explanation_rules WHERE id = ?", (rule_id,))
+        if not cursor.rowcount:
+            return False
+        _bump_rules_version(cursor)
+        return True
+
+
+def check_health() -> Dict:
+    """Verify the pooled connections can still reach the database"""
+    return pool.health_check()
+
+
+def close_pool():
+    """Close all pooled connections (called on application shutdown)"""
+    pool.close()
@@ -0,0 +1,46 @@
+import os
+from collections import OrderedDict
+from typing import Iterable, Tuple
+
+# A log with the same zap name and message as one stored less than this
+# many seconds ago is a duplicate (0 disables duplicate suppression).
+DEDUP_WINDOW_SECONDS = float(os.environ.get("DEDUP_WINDOW_SECONDS", "10"))
+
+
+class DedupWindow:
+    """
+    Content hashes of the logs stored in the last `window` seconds, oldest
+    first, so checking a new log is one dict lookup and expiring old
+    hashes only ever looks at the front.
+    """
+
+    def __init__(self, window: float = DEDUP_WINDOW_SECONDS):
+        self.window = window
+        self._seen: "OrderedDict[int, float]" = OrderedDict()
+
+    def _expire(self, now: float):
+        while self._seen:
+            content_hash, seen = next(iter(self._seen.items()))
+            if now - seen < self.window:
+                break
+            self._seen.popitem(last=False)
+
+    def is_duplicate(self, content_hash: int, now: float) -> bool:
+        self._expire(now)
+        return content_hash in self._seen
+
+    def add(self, content_hash: int, now: float):
+        if self.window <= 0:
+            # Suppression is off; remembering hashes would only grow
+            return
+        self._seen[content_hash] = now
+        self._seen.move_to_end(content_hash)
+
+    def load(self, entries: Iterable[Tuple[int, float]]):
+        """Replace the contents with (content_hash, seen) pairs, oldest first"""
+        self._seen.clear()
+        for content_hash, seen in entries:
+            self.add(content_hash, seen)
+
+    def __len__(self) -> int:
+        return len(self._seen)
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import os
+from typing import AsyncIterator, Dict, Optional, Set
+
+import async_db
+
+SSE_HEARTBEAT_SECONDS = float(os.environ.get("SSE_HEARTBEAT_SECONDS", "15"))
+# Events a subscriber may fall behind by before it is disconnected
+SSE_SUBSCRIBER_BUFFER = int(os.environ.get("SSE_SUBSCRIBER_BUFFER", "256"))
+
+_CLOSED = object()
+
+
+class Subscriber:
+    def __init__(self, buffer: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=buffer)
+
+    def offer(self, event) -> bool:
+        """Queue an event; returns False if the subscriber is too far behind"""
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def close(self):
+        # Drop everything still queued: the client resumes from the last
+        # event it actually received, so nothing may be skipped over.
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(_CLOSED)
+
+
+class ChangeBroker:
+    """
+    In-process pub/sub for log changes.
+
+    After each write that moved the change version the broker reads the
+    delta once with db.get_changes and fans the same event out to every
+    subscriber, so the database cost does not grow with the number of open
+    dashboards. Writes made by other worker processes never reach notify,
+    so while anyone is subscribed the version is also checked once per
+    heartbeat. Event ids are change
+    versions, which is what makes Last-Event-ID resume possible.
+    """
+
+    def __init__(self, buffer: int = SSE_SUBSCRIBER_BUFFER):
+        self.buffer = buffer
+        self._subscribers: Set[Subscriber] = set()
+        self._version: Optional[int] = None
+        self._wakeup = None
+        self._task = None
+
+    async def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+            async_db.add_write_listener(self.notify)
+
+    async def stop(self):
+        if self._task is None:
+            return
+        async_db.remove_write_listener(self.notify)
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        for subscriber in list(self._subscribers):
+            subscriber.close()
+        self._subscribers.clear()
+
+    def notify(self):
+        """Signal that error_logs changed; cheap and safe to call often"""
+        if self._wakeup is not None and self._subscribers:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), SSE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if not self._subscribers or self._version is None:
+                continue
+            try:
+                # Rollups, pruning and vacuum are writes too but leave the
+                # version alone; only a moved version is worth a delta read
+                if await async_db.get_change_version() == self._version:
+                    continue
+                changes = await async_db.get_changes(self._version)
+            except Exception as e:
+                print(f"⚠️ Failed to read log changes for subscribers: {e}")
+                continue
+            self._version = changes["version"]
+            self._publish(changes)
+
+    def _publish(self, changes: Dict):
+        if not (changes["reset"] or changes["upserts"] or changes["deleted"]):
+            return
+        for subscriber in list(self._subscribers):
+            if not subscriber.offer(changes):
+                # Slow consumer: drop it; the client reconnects with
+                # Last-Event-ID and catches up from the database.
+                self._subscribers.discard(subscriber)
+                subscriber.close()
+
+    async def subscribe(self, since: Optional[int] = None) -> AsyncIterator[str]:
+        """
+        Yield SSE frames for new changes. With `since`, changes after that
+        version are replayed first.
+        """
+        subscriber = Subscriber(self.buffer)
+        if self._version is None:
+            version = await async_db.get_change_version()
+            if self._version is None:
+                self._version = version
+        # Register before reading the catch-up so nothing falls in between
+        self._subscribers.add(subscriber)
+        try:
+            sent = self._version
+            if since is not None:
+                changes = await async_db.get_changes(since)
+                sent = changes["version"]
+                if changes["reset"] or changes["upserts"] or changes["deleted"]:
+                    yield _format(changes)
+            while True:
+                try:
+                    event = await asyncio.wait_for(
+                        subscriber.queue.get(), SSE_HEARTBEAT_SECONDS
+                    )
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+                if event is _CLOSED:
+                    return
+                if event["version"] <= sent:
+                    continue
+                sent = event["version"]
+                yield _format(event)
+        finally:
+            self._subscribers.discard(subscriber)
+            if not self._subscribers:
+                # Re-read the version when the next subscriber arrives
+                self._version = None
+
+
+def _format(changes: Dict) -> str:
+    if changes["reset"]:
+        return f"id: {changes['version']}\nevent: reset\ndata: {{}}\n\n"
+    data = json.dumps(
+        {
+            "upserts": changes["upserts"],
+            "deleted": changes["deleted"],
+            "stats": changes["stats"],
+        }
+    )
+    return f"id: {changes['version']}\nevent: changes\ndata: {data}\n\n"
+
+
+broker = ChangeBroker()
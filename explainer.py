@@ -0,0 +1,256 @@
+import asyncio
+import hashlib
+import os
+from collections import OrderedDict, deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import async_db
+from db import DEFAULT_EXPLANATION
+
+# How often each worker checks the database for rule changes
+RULES_POLL_SECONDS = float(os.environ.get("RULES_POLL_SECONDS", "0.5"))
+# Memory budget for memoized explanations
+EXPLAIN_CACHE_BYTES = int(os.environ.get("EXPLAIN_CACHE_BYTES", str(4 * 1024 * 1024)))
+
+# Built-in error explanations, in priority order: when several patterns
+# occur in a message, the first one listed wins. They seed the
+# explanation_rules table, which is the source of truth afterwards.
+ERROR_EXPLANATIONS = {
+    "not found": "Resource was renamed or deleted",
+    "missing required field": "Check if field names changed",
+    "auth expired": "Reauthorization needed",
+    "rate limit": "API rate limit reached",
+    "invalid data type": "Check field mappings",
+}
+
+
+class ExplanationMatcher:
+    """
+    Aho-Corasick automaton over the (lowercased) rule patterns.
+
+    The automaton is compiled into a plain transition table once, so
+    matching a message is a single pass over its characters no matter how
+    many rules there are. Among all patterns occurring in the message the
+    one with the lowest priority index wins, which is the same answer as
+    checking the rules one by one in order.
+    """
+
+    def __init__(self, rules: Iterable[Tuple[str, str]]):
+        self.rules: List[Tuple[str, str]] = [
+            (pattern.lower(), explanation) for pattern, explanation in rules if pattern
+        ]
+        self._transitions: List[Dict[str, int]] = []
+        self._outputs: List[int] = []
+        self._build()
+
+    def _build(self):
+        goto: List[Dict[str, int]] = [{}]
+        outputs = [-1]
+        for priority, (pattern, _) in enumerate(self.rules):
+            state = 0
+            for ch in pattern:
+                if ch not in goto[state]:
+                    goto.append({})
+                    outputs.append(-1)
+                    goto[state][ch] = len(goto) - 1
+                state = goto[state][ch]
+            if outputs[state] == -1:
+                outputs[state] = priority
+
+        # Breadth-first, so each state's failure target is finished first.
+        # A state's transitions are its failure state's transitions
+        # overlaid with its own edges, and it reports the best output of
+        # any pattern that ends there.
+        fail = [0] * len(goto)
+        transitions: List[Optional[Dict[str, int]]] = [None] * len(goto)
+        transitions[0] = dict(goto[0])
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            failure = fail[state]
+            transitions[state] = {**transitions[failure], **goto[state]}
+            if outputs[failure] != -1 and (
+                outputs[state] == -1 or outputs[failure] < outputs[state]
+            ):
+                outputs[state] = outputs[failure]
+            for ch, child in goto[state].items():
+                fail[child] = transitions[failure].get(ch, 0) if state else 0
+                queue.append(child)
+
+        self._transitions = transitions
+        self._outputs = outputs
+
+    def match(self, message: str) -> Optional[int]:
+        """Index of the highest-priority rule found in message, or None"""
+        transitions, outputs = self._transitions, self._outputs
+        state, best = 0, -1
+        for ch in message.lower():
+            state = transitions[state].get(ch, 0)
+            found = outputs[state]
+            if found != -1 and (best == -1 or found < best):
+                best = found
+                if best == 0:
+                    break
+        return None if best == -1 else best
+
+    def explain(self, message: str) -> str:
+        index = self.match(message)
+        return DEFAULT_EXPLANATION if index is None else self.rules[index][1]
+
+
+class ExplanationCache:
+    """
+    LRU memo of message -> explanation, keyed by a 16-byte hash of the
+    message so long messages cost the same as short ones. Bounded by an
+    approximate byte budget rather than an entry count.
+    """
+
+    # Rough per-entry cost of the dict slot, list node and key object
+    ENTRY_OVERHEAD = 120
+
+    def __init__(self, max_bytes: int = EXPLAIN_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[bytes, str]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(message: str) -> bytes:
+        return hashlib.blake2b(
+            message.encode("utf-8", "surrogatepass"), digest_size=16
+        ).digest()
+
+    def _cost(self, key: bytes, value: str) -> int:
+        return len(key) + len(value) + self.ENTRY_OVERHEAD
+
+    def get(self, key: bytes) -> Optional[str]:
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: bytes, value: str):
+        cost = self._cost(key, value)
+        if cost > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= self._cost(key, old)
+        self._entries[key] = value
+        self._bytes += cost
+        while self._bytes > self.max_bytes:
+            evicted_key, evicted = self._entries.popitem(last=False)
+            self._bytes -= self._cost(evicted_key, evicted)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+cache = ExplanationCache()
+
+# The active matcher and the rules version it was compiled from, swapped
+# as one tuple so readers never see a mismatched pair.
+_active: Tuple[ExplanationMatcher, int] = (
+    ExplanationMatcher(ERROR_EXPLANATIONS.items()),
+    -1,
+)
+
+
+def set_rules(rules: Iterable[Tuple[str, str]], version: int = -1):
+    """Compile a new rule set and swap it in for subsequent explain calls"""
+    _swap(ExplanationMatcher(rules), version)
+
+
+def _swap(matcher: ExplanationMatcher, version: int):
+    global _active
+    _active = (matcher, version)
+    # Memoized answers came from the old rules
+    cache.clear()
+
+
+def rules_version() -> int:
+    """Version of the rule set currently in use (-1 for the built-ins)"""
+    return _active[1]
+
+
+def explain_error(error_msg: str) -> str:
+    """Generate explanation based on error message patterns"""
+    key = cache.key(error_msg)
+    explanation = cache.get(key)
+    if explanation is None:
+        explanation = _active[0].explain(error_msg)
+        cache.put(key, explanation)
+    return explanation
+
+
+class RuleReloader:
+    """
+    Keeps this worker's matcher in sync with the explanation_rules table.
+
+    Polls the rules version (a single-row read) and, when it moves,
+    loads the rules, compiles them off the event loop and swaps the new
+    matcher in. Ingestion keeps using the old matcher until the swap.
+    """
+
+    def __init__(self, interval: float = RULES_POLL_SECONDS):
+        self.interval = interval
+        self._task = None
+        self._lock = None
+
+    async def start(self):
+        if self._task is None:
+            self._lock = asyncio.Lock()
+            await async_db.seed_explanation_rules(list(ERROR_EXPLANATIONS.items()))
+            await self.reload()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def reload(self):
+        """Recompile the matcher if the stored rules changed"""
+        async with self._lock:
+            if await async_db.get_rules_version() == rules_version():
+                return
+            data = await async_db.get_explanation_rules()
+            rules = [(rule["pattern"], rule["explanation"]) for rule in data["rules"]]
+            # Compiling is CPU work; keep it off the event loop
+            matcher = await async_db.run_read(ExplanationMatcher, rules)
+            if data["version"] > rules_version():
+                _swap(matcher, data["version"])
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.reload()
+            except Exception as e:
+                print(f"⚠️ Failed to reload explanation rules: {e}")
+
+
+reloader = RuleReloader()
@@ -0,0 +1,182 @@
+import csv
+import io
+import json
+import os
+import zlib
+from typing import AsyncIterator, Dict, List
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # Arrow/Parquet exports are optional
+    pyarrow = None
+
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "500"))
+PARQUET_ROW_GROUP_SIZE = int(os.environ.get("PARQUET_ROW_GROUP_SIZE", "65536"))
+
+EXPORT_COLUMNS = [
+    "id",
+    "zap_name",
+    "error_message",
+    "explanation",
+    "timestamp",
+    "ingested_at",
+    "status",
+]
+TIMESTAMP_COLUMNS = ("timestamp", "ingested_at")
+
+# format -> (media type, file extension)
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "csv.gz": ("application/gzip", "csv.gz"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "ndjson.gz": ("application/gzip", "ndjson.gz"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrow"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+ARROW_FORMATS = ("arrow", "parquet")
+
+
+async def csv_chunks(batches: AsyncIterator[List[Dict]]) -> AsyncIterator[bytes]:
+    """Encode batches of log rows as CSV, one chunk per batch"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS, extrasaction="ignore")
+    writer.writeheader()
+    async for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # No rows at all: still send the header
+        yield buffer.getvalue().encode()
+
+
+async def ndjson_chunks(batches: AsyncIterator[List[Dict]]) -> AsyncIterator[bytes]:
+    """Encode batches of log rows as newline-delimited JSON"""
+    async for batch in batches:
+        lines = (json.dumps({key: row[key] for key in EXPORT_COLUMNS}) for row in batch)
+        yield ("\n".join(lines) + "\n").encode()
+
+
+async def gzip_chunks(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Gzip a byte stream on the fly"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class _ChunkSink:
+    """Write-only file object that collects output until it is drained"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _arrow_schema():
+    return pyarrow.schema(
+        [
+            ("id", pyarrow.int64()),
+            ("zap_name", pyarrow.string()),
+            ("error_message", pyarrow.string()),
+            ("explanation", pyarrow.string()),
+            ("timestamp", pyarrow.timestamp("s")),
+            ("ingested_at", pyarrow.timestamp("s")),
+            ("status", pyarrow.string()),
+        ]
+    )
+
+
+def _record_batch(schema, rows: List[Dict]):
+    columns = {name: [row[name] for row in rows] for name in EXPORT_COLUMNS}
+    arrays = [
+        pyarrow.compute.strptime(
+            pyarrow.array(columns[name], pyarrow.string()),
+            format="%Y-%m-%d %H:%M:%S",
+            unit="s",
+        )
+        if name in TIMESTAMP_COLUMNS
+        else pyarrow.array(columns[name], field.type)
+        for name, field in zip(EXPORT_COLUMNS, schema)
+    ]
+    return pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+async def arrow_chunks(batches: AsyncIterator[List[Dict]]) -> AsyncIterator[bytes]:
+    """Encode log rows as an Arrow IPC stream, one record batch per batch"""
+    schema = _arrow_schema()
+    sink = _ChunkSink()
+    writer = pyarrow.ipc.new_stream(sink, schema)
+    async for batch in batches:
+        writer.write_batch(_record_batch(schema, batch))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+async def parquet_chunks(batches: AsyncIterator[List[Dict]]) -> AsyncIterator[bytes]:
+    """
+    Encode log rows as Parquet. Rows are buffered only up to one row group
+    (PARQUET_ROW_GROUP_SIZE), which is written and streamed out as soon as
+    it is full.
+    """
+    schema = _arrow_schema()
+    sink = _ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema, compression="zstd")
+    pending, pending_rows = [], 0
+
+    def write_row_group():
+        table = pyarrow.Table.from_batches(pending, schema)
+        writer.write_table(table, row_group_size=table.num_rows)
+
+    async for batch in batches:
+        pending.append(_record_batch(schema, batch))
+        pending_rows += len(batch)
+        if pending_rows >= PARQUET_ROW_GROUP_SIZE:
+            write_row_group()
+            pending, pending_rows = [], 0
+            yield sink.drain()
+    if pending:
+        write_row_group()
+    writer.close()
+    yield sink.drain()
+
+
+def encode(format: str, batches: AsyncIterator[List[Dict]]) -> AsyncIterator[bytes]:
+    """Return the byte stream for an export `format` (a key of EXPORT_FORMATS)"""
+    if format in ("csv", "csv.gz"):
+        chunks = csv_chunks(batches)
+    elif format in ("ndjson", "ndjson.gz"):
+        chunks = ndjson_chunks(batches)
+    elif format == "arrow":
+        return arrow_chunks(batches)
+    else:
+        return parquet_chunks(batches)
+    return gzip_chunks(chunks) if format.endswith(".gz") else chunks
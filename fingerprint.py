@@ -0,0 +1,68 @@
+import hashlib
+import re
+from typing import Optional, Tuple
+
+MAX_TEMPLATE_LENGTH = 500
+
+# Variable parts of error messages, replaced in this order (URLs and
+# emails before the bare numbers inside them).
+_REPLACEMENTS = [
+    (re.compile(r"\b(?:https?://|www\.)\S+", re.IGNORECASE), "<url>"),
+    (re.compile(r"\b[\w.+-]+@[\w-]+(?:\.[\w-]+)+\b"), "<email>"),
+    (
+        re.compile(
+            r"\b\d{4}-\d{2}-\d{2}(?:[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?"
+            r"(?:Z|[+-]\d{2}:?\d{2})?)?\b"
+        ),
+        "<ts>",
+    ),
+    (re.compile(r"\b\d{1,2}:\d{2}(?::\d{2}(?:\.\d+)?)?\b"), "<ts>"),
+    (
+        re.compile(
+            r"\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b",
+            re.IGNORECASE,
+        ),
+        "<uuid>",
+    ),
+    (re.compile(r"\b0x[0-9a-f]+\b", re.IGNORECASE), "<hex>"),
+    # Record ids such as "rec8Xk2Lq9" or long hex digests: long words that
+    # contain at least one digit
+    (re.compile(r"\b(?=[a-z]*\d)[a-z0-9_-]{8,}\b", re.IGNORECASE), "<id>"),
+    (re.compile(r"[-+]?\b\d+(?:\.\d+)?"), "<num>"),
+]
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(message: str) -> str:
+    """Reduce an error message to a template with its variable parts masked"""
+    template = message
+    for pattern, placeholder in _REPLACEMENTS:
+        template = pattern.sub(placeholder, template)
+    template = _WHITESPACE.sub(" ", template).strip().lower()
+    return template[:MAX_TEMPLATE_LENGTH]
+
+
+def fingerprint(zap_name: str, error_message: str) -> Tuple[str, str]:
+    """Return (fingerprint, template); one fingerprint per zap and template"""
+    template = normalize(error_message)
+    digest = hashlib.blake2b(
+        f"{zap_name}\0{template}".encode("utf-8", "surrogatepass"), digest_size=8
+    )
+    return digest.hexdigest(), template
+
+
+def content_hash(
+    zap_name: str, error_message: str, event_ts: Optional[int] = None
+) -> int:
+    """
+    64-bit signed hash of the exact zap name and message, for dedup, plus
+    the event time when the sender supplied one (so a backfill of the same
+    error at different times is not a duplicate).
+    """
+    content = f"{zap_name}\0{error_message}"
+    if event_ts is not None:
+        content += f"\0{event_ts}"
+    digest = hashlib.blake2b(
+        content.encode("utf-8", "surrogatepass"), digest_size=8
+    ).digest()
+    return int.from_bytes(digest, "big", signed=True)
@@ -0,0 +1,163 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import async_db
+
+# How long a key's response is replayed, how many keys each worker keeps
+# in memory, and how often new keys are written to the database.
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_MAX_KEYS = int(os.environ.get("IDEMPOTENCY_MAX_KEYS", "100000"))
+IDEMPOTENCY_FLUSH_MS = float(os.environ.get("IDEMPOTENCY_FLUSH_MS", "1000"))
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used for a request with a different body"""
+
+
+class Claim:
+    """Outcome of claiming a key: a response to replay, or one to record"""
+
+    def __init__(self, replay: Optional[Dict] = None):
+        self.replay = replay
+        self.status_code: Optional[int] = None
+        self.body: Any = None
+
+    def record(self, status_code: int, body: Any):
+        self.status_code = status_code
+        self.body = body
+
+
+class IdempotencyStore:
+    """
+    Remembers the response sent for each Idempotency-Key.
+
+    Keys live in a TTL-bounded LRU in memory, so a retry storm on one
+    worker costs a dict lookup. New keys are written to SQLite in batches
+    in the background, so they survive restarts and other workers find
+    them with a primary key read. Concurrent requests with the same key on
+    one worker wait for the first one instead of racing it.
+    """
+
+    def __init__(
+        self,
+        ttl: int = IDEMPOTENCY_TTL_SECONDS,
+        max_keys: int = IDEMPOTENCY_MAX_KEYS,
+        flush_ms: float = IDEMPOTENCY_FLUSH_MS,
+    ):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.flush_interval = flush_ms / 1000
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._pending: List[Dict] = []
+        self._task = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher and write out keys that are still pending"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.flush()
+
+    def _get(self, key: str) -> Optional[Dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry["created_at"] < time.time() - self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _put(self, entry: Dict):
+        self._entries[entry["key"]] = entry
+        self._entries.move_to_end(entry["key"])
+        while len(self._entries) > self.max_keys:
+            self._entries.popitem(last=False)
+
+    async def _lookup(self, key: str) -> Optional[Dict]:
+        entry = self._get(key)
+        if entry is None:
+            entry = await async_db.get_idempotency_key(
+                key, int(time.time()) - self.ttl
+            )
+            if entry is not None:
+                self._put(entry)
+        return entry
+
+    @asynccontextmanager
+    async def claim(self, key: str, request_hash: str) -> AsyncIterator[Claim]:
+        """
+        Claim a key for one request. If the key already has a response,
+        `claim.replay` holds it; otherwise the caller handles the request
+        and calls `claim.record`. Raises IdempotencyConflict if the key
+        was used with a different request body.
+        """
+        while key in self._in_flight:
+            await asyncio.shield(self._in_flight[key])
+        entry = self._get(key)
+        if entry is None:
+            future = asyncio.get_running_loop().create_future()
+            self._in_flight[key] = future
+            try:
+                entry = await self._lookup(key)
+                if entry is None:
+                    claim = Claim()
+                    yield claim
+                    if claim.status_code is not None:
+                        self._save(key, request_hash, claim)
+                    return
+            finally:
+                del self._in_flight[key]
+                future.set_result(None)
+        if entry["request_hash"] != request_hash:
+            raise IdempotencyConflict(
+                "Idempotency-Key was already used with a different request"
+            )
+        yield Claim(replay=entry)
+
+    def _save(self, key: str, request_hash: str, claim: Claim):
+        entry = {
+            "key": key,
+            "request_hash": request_hash,
+            "status_code": claim.status_code,
+            "body": claim.body,
+            "created_at": int(time.time()),
+        }
+        self._put(entry)
+        self._pending.append(entry)
+
+    async def flush(self):
+        """Write pending keys to the database and expire old ones"""
+        if not self._pending:
+            return
+        entries, self._pending = self._pending, []
+        try:
+            await async_db.save_idempotency_keys(
+                entries, int(time.time()) - self.ttl
+            )
+        except Exception as e:
+            print(f"⚠️ Failed to store {len(entries)} idempotency keys: {e}")
+            self._pending = entries + self._pending
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+
+store = IdempotencyStore()
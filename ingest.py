@@ -0,0 +1,238 @@
+import asyncio
+import os
+import sqlite3
+from contextlib import asynccontextmanager
+from typing import List, Optional, Tuple, Union
+
+import async_db
+from async_db import DatabaseBusyError, DatabaseTimeoutError
+from db import check_event_ts, check_text
+
+# A batch is flushed when it reaches INGEST_BATCH_SIZE rows or when its
+# oldest row has waited INGEST_FLUSH_MS, whichever comes first.
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", "256"))
+INGEST_FLUSH_MS = float(os.environ.get("INGEST_FLUSH_MS", "10"))
+INGEST_QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", "10000"))
+# "commit": webhook responds once its row is committed and returns the id.
+# "enqueue": webhook responds as soon as the row is queued (202, no id).
+INGEST_DURABILITY = os.environ.get("INGEST_DURABILITY", "commit")
+
+if INGEST_DURABILITY not in ("commit", "enqueue"):
+    raise ValueError("INGEST_DURABILITY must be 'commit' or 'enqueue'")
+
+# (zap_name, error_message, explanation, event_ts in epoch ms or None)
+Row = Tuple[str, str, Optional[str], Optional[int]]
+
+_STOP = object()
+
+# Failures of the database itself rather than of a row in the batch
+_DATABASE_ERRORS = (DatabaseBusyError, DatabaseTimeoutError, sqlite3.OperationalError)
+
+
+class IngestBusyError(DatabaseBusyError):
+    """Raised when the ingestion queue is full or shutting down"""
+
+
+def check_row(row: Row) -> Row:
+    """Return row unchanged; ValueError if it could never be inserted"""
+    zap_name, error_message, explanation, event_ts = row
+    check_text(zap_name, "zap_name")
+    check_text(error_message, "error_message")
+    if explanation is not None:
+        check_text(explanation, "explanation")
+    if event_ts is not None:
+        check_event_ts(event_ts)
+    return row
+
+
+async def insert_rows(rows: List[Row]) -> List[Union[int, Exception]]:
+    """
+    Insert rows in one transaction. If a row makes that fail, they are
+    retried one at a time so only the bad rows fail: each result is the
+    new id (-1 for a duplicate) or that row's exception. Failures of the
+    database itself are raised.
+    """
+    try:
+        return await async_db.insert_error_logs(rows)
+    except _DATABASE_ERRORS:
+        raise
+    except Exception as e:
+        if len(rows) == 1:
+            return [e]
+    results = []
+    for row in rows:
+        try:
+            results.extend(await async_db.insert_error_logs([row]))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+class IngestPipeline:
+    """
+    Write-behind queue for new error logs.
+
+    Handlers enqueue rows and a single writer task commits them in batches,
+    so a burst of webhooks costs one transaction per batch instead of one
+    per request. Each row's future resolves to its new id (-1 for a
+    duplicate) once the batch is committed.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = INGEST_BATCH_SIZE,
+        flush_ms: float = INGEST_FLUSH_MS,
+        queue_size: int = INGEST_QUEUE_SIZE,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.queue_size = queue_size
+        self._queue = None
+        self._task = None
+        self._accepting = False
+        self._resumed = None
+
+    async def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._resumed = asyncio.Event()
+            self._resumed.set()
+            self._accepting = True
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop accepting rows and wait until everything queued is committed"""
+        if self._task is None:
+            return
+        self._accepting = False
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    @asynccontextmanager
+    async def paused(self):
+        """
+        Hold back flushes while the body runs (e.g. an index build holding
+        the write lock). Enqueued rows keep queueing up to queue_size
+        meanwhile; callers waiting for a commit get IngestBusyError (a 503
+        with Retry-After) rather than waiting for the pause to end.
+        """
+        if self._resumed is None:
+            yield
+            return
+        self._resumed.clear()
+        try:
+            yield
+        finally:
+            self._resumed.set()
+
+    def _put(self, row: Row, future: Optional[asyncio.Future]):
+        if not self._accepting:
+            raise IngestBusyError("Ingestion is shutting down")
+        # A row that cannot be stored fails its own request, not its batch
+        check_row(row)
+        try:
+            self._queue.put_nowait((row, future))
+        except asyncio.QueueFull:
+            raise IngestBusyError("Ingestion queue is full")
+
+    async def insert(
+        self,
+        zap_name: str,
+        error_message: str,
+        explanation: Optional[str] = None,
+        event_ts: Optional[int] = None,
+    ) -> int:
+        """Queue a row and wait for it to be committed; returns its id"""
+        if self._resumed is not None and not self._resumed.is_set():
+            raise IngestBusyError("Ingestion is paused for a schema change")
+        future = asyncio.get_running_loop().create_future()
+        self._put((zap_name, error_message, explanation, event_ts), future)
+        return await future
+
+    def enqueue(
+        self,
+        zap_name: str,
+        error_message: str,
+        explanation: Optional[str] = None,
+        event_ts: Optional[int] = None,
+    ):
+        """Queue a row without waiting for the commit"""
+        self._put((zap_name, error_message, explanation, event_ts), None)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                # Take whatever is already queued before waiting at all
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            if not self._resumed.is_set():
+                batch, stopped = self._shed(batch)
+                stopping = stopping or stopped
+                await self._resumed.wait()
+            if batch:
+                await self._flush(batch)
+
+    def _shed(self, batch: List[Tuple[Row, Optional[asyncio.Future]]]):
+        """
+        Fail the callers waiting on held rows, in batch or still queued,
+        and return the enqueued rows to flush after the pause, plus whether
+        the stop marker was taken off the queue.
+        """
+        stopping = False
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            if item is _STOP:
+                stopping = True
+                break
+            batch.append(item)
+        error = IngestBusyError("Ingestion is paused for a schema change")
+        kept = []
+        for row, future in batch:
+            if future is None:
+                kept.append((row, future))
+            elif not future.done():
+                future.set_exception(error)
+        return kept, stopping
+
+    async def _flush(self, batch: List[Tuple[Row, Optional[asyncio.Future]]]):
+        rows = [row for row, _ in batch]
+        try:
+            results = await insert_rows(rows)
+        except Exception as e:
+            print(f"⚠️ Failed to write {len(rows)} queued logs: {e}")
+            for _, future in batch:
+                if future is not None and not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                print(f"⚠️ Failed to write queued log: {result}")
+                if future is not None and not future.done():
+                    future.set_exception(result)
+            elif future is not None and not future.done():
+                future.set_result(result)
+
+pipeline = IngestPipeline()
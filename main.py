@@ -1,32 +1,102 @@
 from fastapi import FastAPI, Request, HTTPException, Depends
+from fastapi import Response
 from fastapi.responses import JSONResponse, StreamingResponse, HTMLResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from db import (
-    init_db,
-    insert_error_log,
-    get_all_logs,
+from contextlib import asynccontextmanager
+from db import init_db, close_pool, iter_logs, pool, check_text, to_epoch_ms
+from async_db import (
+    DatabaseBusyError,
+    DatabaseTimeoutError,
     update_log_status,
     clear_all_logs,
-    get_logs_by_status,
+    get_logs_page,
+    get_sync_state,
+    get_changes,
+    get_stats,
+    get_aggregates,
+    get_log_archives,
+    discard_log_archive,
+    check_health,
+    get_explanation_rules,
+    create_explanation_rule,
+    update_explanation_rule,
+    delete_explanation_rule,
+    get_error_groups,
+    get_error_group,
+    update_group_status,
+    get_log_templates,
+    set_template_explanation,
+)
+import async_db
+import migrations
+from ingest import pipeline, INGEST_DURABILITY
+from bulk import parser_for, ingest_stream
+from events import broker
+from rollups import rollup_worker
+from retention import retention_worker
+from idempotency import IdempotencyConflict, MAX_KEY_LENGTH, store as idempotency
+from explainer import explain_error, reloader
+import explainer
+from export import (
+    ARROW_FORMATS,
+    EXPORT_BATCH_SIZE,
+    EXPORT_FORMATS,
+    encode,
+    gzip_chunks,
+    pyarrow,
 )
 from fastapi import Query
 from datetime import datetime
-from typing import Optional
-from pydantic import BaseModel
-from fastapi import Body
+from typing import Optional, Union
+from pydantic import BaseModel, Field
+from fastapi import Body, Header
 from typing import Any, Dict
-import csv
+from email.utils import formatdate
+import asyncio
+import hashlib
+import json
 import os
-import io
+import sqlite3
 import uvicorn
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Initialize database and the thread pools that serve it
+    deferred = init_db()
+    async_db.start()
+    await reloader.start()
+    await pipeline.start()
+    await broker.start()
+    await idempotency.start()
+    await rollup_worker.start()
+    await retention_worker.start()
+    # Index builds on big tables run now that requests are being served;
+    # webhooks queue up in the pipeline while each one holds the write lock
+    schema_task = asyncio.create_task(
+        migrations.apply_online(pool, deferred, pipeline.paused)
+    )
+    yield
+    schema_task.cancel()
+    await asyncio.gather(schema_task, return_exceptions=True)
+    await retention_worker.stop()
+    await rollup_worker.stop()
+    await idempotency.stop()
+    await broker.stop()
+    await reloader.stop()
+    # Drain queued rows before the write pool goes away
+    await pipeline.stop()
+    async_db.shutdown()
+    close_pool()
+
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Zapier Error Dashboard API",
     description="API for managing and viewing Zapier error logs",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Setup CORS
@@ -36,75 +106,135 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[
+        "ETag",
+        "Last-Modified",
+        "X-Change-Version",
+        "X-Next-Cursor",
+        "X-Prev-Cursor",
+        "Link",
+        "Idempotent-Replayed",
+    ],
 )
 
-# Initialize database
-init_db()
-
 # Serve static files (for production)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
+@app.exception_handler(DatabaseBusyError)
+async def database_busy_handler(request: Request, exc: DatabaseBusyError):
+    return JSONResponse(
+        status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"}
+    )
+
+
+@app.exception_handler(DatabaseTimeoutError)
+async def database_timeout_handler(request: Request, exc: DatabaseTimeoutError):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+
 # Models
 class ErrorLogCreate(BaseModel):
     zap_name: str
     error_message: str
     explanation: Optional[str] = None
+    timestamp: Optional[Union[int, float, str]] = None
 
 
 class LogStatusUpdate(BaseModel):
     status: str
 
 
-# Error explanations
-ERROR_EXPLANATIONS = {
-    "not found": "Resource was renamed or deleted",
-    "missing required field": "Check if field names changed",
-    "auth expired": "Reauthorization needed",
-    "rate limit": "API rate limit reached",
-    "invalid data type": "Check field mappings",
-}
+class RuleCreate(BaseModel):
+    pattern: str = Field(..., min_length=1)
+    explanation: str = Field(..., min_length=1)
+    priority: Optional[int] = None
+
 
+class RuleUpdate(BaseModel):
+    pattern: Optional[str] = Field(None, min_length=1)
+    explanation: Optional[str] = Field(None, min_length=1)
+    priority: Optional[int] = None
 
-def explain_error(error_msg: str) -> str:
-    """Generate explanation based on error message patterns"""
-    error_lower = error_msg.lower()
-    for pattern, explanation in ERROR_EXPLANATIONS.items():
-        if pattern in error_lower:
-            return explanation
-    return "No specific explanation available"
+
+class TemplateExplanation(BaseModel):
+    explanation: str = Field(..., min_length=1)
 
 
 # API Endpoints
+async def _ingest_payload(payload: Dict[str, Any]):
+    """Store one Zapier payload; returns (status_code, body) of the response"""
+    zap_name = payload.get("zap_name")
+    error_message = payload.get("error_message")
+    timestamp = payload.get("timestamp")  # optional
+
+    if not zap_name or not error_message:
+        raise HTTPException(status_code=400, detail="Missing zap_name or error_message")
+
+    try:
+        # Before anything hashes or matches the message
+        check_text(zap_name, "zap_name")
+        check_text(error_message, "error_message")
+        # The Zap's own event time, if it sent one; otherwise the time we got it
+        event_ts = None if timestamp is None else to_epoch_ms(timestamp)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    explanation = explain_error(error_message)
+    try:
+        if INGEST_DURABILITY == "enqueue":
+            pipeline.enqueue(zap_name, error_message, explanation, event_ts)
+            return 202, {"status": "queued"}
+
+        log_id = await pipeline.insert(zap_name, error_message, explanation, event_ts)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if log_id == -1:
+        return 409, {"detail": "Duplicate log entry"}
+
+    return 201, {"id": log_id}
+
+
 @app.post("/api/zapier_payload", status_code=201)
-async def receive_zapier_payload(payload: Dict[str, Any] = Body(...)):
+async def receive_zapier_payload(
+    payload: Dict[str, Any] = Body(...),
+    idempotency_key: Optional[str] = Header(None),
+):
     """
     Zapier sends this payload from a webhook step.
     Expected fields:
     - zap_name
     - error_message
     - timestamp (optional)
+
+    With an Idempotency-Key header, a retry of the same request gets the
+    original response back (marked Idempotent-Replayed) without another
+    write.
     """
     try:
-        zap_name = payload.get("zap_name")
-        error_message = payload.get("error_message")
-        timestamp = payload.get("timestamp")  # optional
-
-        if not zap_name or not error_message:
-            raise HTTPException(
-                status_code=400, detail="Missing zap_name or error_message"
-            )
-
-        # Optionally override timestamp (if coming from Zapier)
-        explanation = explain_error(error_message)
-        log_id = insert_error_log(zap_name, error_message, explanation)
-
-        if log_id == -1:
-            return JSONResponse(
-                status_code=409, content={"detail": "Duplicate log entry"}
-            )
-
-        return {"id": log_id}
+        if idempotency_key is None:
+            status_code, content = await _ingest_payload(payload)
+            return JSONResponse(status_code=status_code, content=content)
+
+        if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail="Invalid Idempotency-Key")
+        request_hash = hashlib.sha256(
+            json.dumps(payload, sort_keys=True).encode()
+        ).hexdigest()
+        async with idempotency.claim(idempotency_key, request_hash) as claim:
+            if claim.replay is None:
+                claim.record(*await _ingest_payload(payload))
+                return JSONResponse(status_code=claim.status_code, content=claim.body)
+        return JSONResponse(
+            status_code=claim.replay["status_code"],
+            content=claim.replay["body"],
+            headers={"Idempotent-Replayed": "true"},
+        )
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except (HTTPException, DatabaseBusyError, DatabaseTimeoutError):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -113,32 +243,195 @@ async def receive_zapier_payload(payload: Dict[str, Any] = Body(...)):
 async def create_error_log(error: ErrorLogCreate):
     """Create a new error log entry"""
     explanation = error.explanation or explain_error(error.error_message)
-    log_id = insert_error_log(
-        zap_name=error.zap_name,
-        error_message=error.error_message,
-        explanation=explanation,
-    )
+    try:
+        event_ts = None if error.timestamp is None else to_epoch_ms(error.timestamp)
+        log_id = await pipeline.insert(
+            zap_name=error.zap_name,
+            error_message=error.error_message,
+            explanation=explanation,
+            event_ts=event_ts,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if log_id == -1:
         raise HTTPException(status_code=409, detail="Duplicate log entry")
     return {"id": log_id}
 
 
+@app.post("/api/errors/bulk")
+async def bulk_create_error_logs(request: Request):
+    """
+    Create many error logs from a JSON array or an application/x-ndjson
+    stream. The body is parsed as it arrives and inserted in chunks.
+    """
+    parser = parser_for(request.headers.get("content-type", ""))
+    result = await ingest_stream(request.stream(), parser, explain_error)
+    if "aborted" in result:
+        # Malformed body or failed write; rows before it were still committed
+        if parser.error:
+            return JSONResponse(status_code=400, content=result)
+        return JSONResponse(status_code=503, content=result, headers={"Retry-After": "1"})
+    return result
+
+
+def collection_etag(version: int, *params) -> str:
+    """Weak ETag for a log listing: the change version plus the query"""
+    query = hashlib.sha1(repr(params).encode()).hexdigest()[:12]
+    return f'W/"{version}-{query}"'
+
+
+def time_range(start: Optional[str], end: Optional[str]):
+    """Parse from/to query parameters into epoch ms; raises ValueError"""
+    return (
+        None if start is None else to_epoch_ms(start),
+        None if end is None else to_epoch_ms(end),
+    )
+
+
+def not_modified(request: Request, etag: str) -> bool:
+    """
+    Evaluate If-None-Match. If-Modified-Since is ignored: its one-second
+    resolution would answer 304 for writes later in the same second.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    # Weak comparison: ignore the W/ prefix on either side
+    opaque = [tag.removeprefix("W/") for tag in tags]
+    return "*" in tags or etag.removeprefix("W/") in opaque
+
+
 @app.get("/api/logs")
-async def get_logs(status: Optional[str] = None):
-    """Get all logs or filter by status"""
+async def get_logs(
+    request: Request,
+    response: Response,
+    status: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    start: Optional[str] = Query(None, alias="from"),
+    end: Optional[str] = Query(None, alias="to"),
+    zap_name: Optional[str] = None,
+):
+    """
+    Get logs newest first by event time, optionally filtered by status or
+    zap_name and by event time (`from` inclusive, `to` exclusive; ISO 8601 or epoch).
+    Results are paged; the X-Next-Cursor / X-Prev-Cursor headers (and
+    Link) carry the cursors for the neighbouring pages.
+    """
     try:
-        if status:
-            return get_logs_by_status(status)
-        return get_all_logs()
+        start_ms, end_ms = time_range(start, end)
+        # Read the version first: rows changed after it are simply sent
+        # again by the next /api/logs/changes call.
+        state = await get_sync_state()
+        version = state["version"]
+        etag = collection_etag(
+            version, status, limit, cursor, start_ms, end_ms, zap_name
+        )
+        last_modified = formatdate(state["changed_at"], usegmt=True)
+        validators = {
+            "ETag": etag,
+            "Last-Modified": last_modified,
+            "X-Change-Version": str(version),
+            "Cache-Control": "no-cache",
+        }
+        if not_modified(request, etag):
+            return Response(status_code=304, headers=validators)
+        logs, next_cursor, prev_cursor = await get_logs_page(
+            status, limit, cursor, start_ms, end_ms, zap_name
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except (DatabaseBusyError, DatabaseTimeoutError):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    response.headers.update(validators)
+    links = []
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+        url = request.url.include_query_params(cursor=next_cursor)
+        links.append(f'<{url}>; rel="next"')
+    if prev_cursor:
+        response.headers["X-Prev-Cursor"] = prev_cursor
+        url = request.url.include_query_params(cursor=prev_cursor)
+        links.append(f'<{url}>; rel="prev"')
+    if links:
+        response.headers["Link"] = ", ".join(links)
+    return logs
+
+
+@app.get("/api/logs/changes")
+async def get_log_changes(
+    since: int = Query(..., ge=0), limit: int = Query(1000, ge=1, le=5000)
+):
+    """
+    Logs inserted or updated and ids deleted since change version `since`
+    (from the X-Change-Version header of /api/logs or a previous call).
+    reset=true means the client must reload /api/logs.
+    """
+    return await get_changes(since, limit)
+
+
+@app.get("/api/stats")
+async def get_log_stats(response: Response):
+    """
+    Log totals, overall and per status. Served from counters maintained on
+    every write, so it costs the same at any table size.
+    """
+    stats = await get_stats()
+    response.headers["X-Change-Version"] = str(stats.pop("version"))
+    response.headers["Cache-Control"] = "no-cache"
+    return stats
+
+
+@app.get("/api/aggregates")
+async def get_log_aggregates(
+    group_by: str = "zap_name",
+    bucket: str = "1h",
+    start: Optional[str] = Query(None, alias="from"),
+    end: Optional[str] = Query(None, alias="to"),
+):
+    """
+    Log counts per time bucket (1m, 1h or 1d), grouped by zap_name, status
+    or explanation, plus totals per group over the range (`from`/`to` as
+    for /api/logs; the last 60 buckets by default). Served from rollups, so
+    trend charts never scan the logs; new logs show up within a few
+    seconds, and old minute/hour buckets are pruned (see rollups.py).
+    """
+    try:
+        start_ms, end_ms = time_range(start, end)
+        return await get_aggregates(group_by, bucket, start_ms, end_ms)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/api/logs/stream")
+async def stream_log_changes(request: Request, since: Optional[int] = Query(None, ge=0)):
+    """
+    Server-Sent Events feed of log changes. Each `changes` event carries
+    upserts and deleted ids; a `reset` event means reload /api/logs. Resumes
+    from the Last-Event-ID header (or `since`) when given.
+    """
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id:
+        try:
+            since = int(last_event_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+    return StreamingResponse(
+        broker.subscribe(since),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 
 @app.patch("/api/logs/{log_id}")
 async def update_log(log_id: int, update: LogStatusUpdate):
     """Update log status"""
     try:
-        success = update_log_status(log_id, update.status)
+        success = await update_log_status(log_id, update.status)
         if not success:
             raise HTTPException(status_code=404, detail="Log not found")
         return {"message": "Status updated"}
@@ -147,40 +440,175 @@ async def update_log(log_id: int, update: LogStatusUpdate):
 
 
 @app.delete("/api/logs")
-async def delete_all_logs():
-    """Clear all logs"""
-    count = clear_all_logs()
-    return {"message": f"Deleted {count} logs"}
+async def delete_all_logs(archive: bool = False):
+    """
+    Clear all logs. The old rows are moved aside in one quick schema swap
+    and purged in the background, or kept as an archive with archive=true.
+    """
+    result = await clear_all_logs(archive)
+    retention_worker.wake()
+    return {"message": f"Deleted {result['deleted']} logs", **result}
+
+
+@app.get("/api/logs/archives")
+async def list_log_archives():
+    """Archives kept by DELETE /api/logs?archive=true, oldest first"""
+    return await get_log_archives()
+
+
+@app.delete("/api/logs/archives/{name}")
+async def delete_log_archive(name: str):
+    """Delete an archive; its rows are purged in the background"""
+    if not await discard_log_archive(name):
+        raise HTTPException(status_code=404, detail="Archive not found")
+    retention_worker.wake()
+    return {"message": "Archive deleted"}
 
 
 @app.get("/api/logs/export")
-async def export_logs(status: Optional[str] = Query(None), format: str = "csv"):
-    """
-    Export logs in CSV format, optionally filtered by status
-    """
-    # Validate and get logs
-    if status:
-        logs = get_logs_by_status(status)
-    else:
-        logs = get_all_logs()
-
-    if format == "csv":
-        output = io.StringIO()
-        writer = csv.DictWriter(output, fieldnames=logs[0].keys() if logs else [])
-        writer.writeheader()
-        writer.writerows(logs)
-        output.seek(0)
-
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        return StreamingResponse(
-            io.BytesIO(output.getvalue().encode()),
-            media_type="text/csv",
-            headers={
-                "Content-Disposition": f"attachment; filename=zapier_logs_{timestamp}.csv"
-            },
+async def export_logs(
+    request: Request,
+    status: Optional[str] = Query(None),
+    format: str = "csv",
+    start: Optional[str] = Query(None, alias="from"),
+    end: Optional[str] = Query(None, alias="to"),
+    zap_name: Optional[str] = None,
+):
+    """
+    Export logs, optionally filtered by status, zap_name and event time range
+    (`from`/`to`, as for /api/logs), as csv, csv.gz, ndjson,
+    ndjson.gz, arrow (IPC stream) or parquet. Rows are streamed from the
+    database in batches, so the export is never held in memory as a whole.
+    Plain csv/ndjson are gzip-encoded on the fly if the client accepts it.
+    """
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Unsupported export format")
+    if format in ARROW_FORMATS and pyarrow is None:
+        raise HTTPException(
+            status_code=501, detail=f"{format} export requires pyarrow"
         )
+    try:
+        start_ms, end_ms = time_range(start, end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    raise HTTPException(status_code=400, detail="Unsupported export format")
+    media_type, extension = EXPORT_FORMATS[format]
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    headers = {
+        "Content-Disposition": f"attachment; filename=zapier_logs_{timestamp}.{extension}"
+    }
+    batches = async_db.iterate_read(
+        iter_logs(status, EXPORT_BATCH_SIZE, start_ms, end_ms, zap_name)
+    )
+    chunks = encode(format, batches)
+
+    accept_encoding = request.headers.get("accept-encoding", "")
+    if format in ("csv", "ndjson") and "gzip" in accept_encoding.lower():
+        chunks = gzip_chunks(chunks)
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+    return StreamingResponse(chunks, media_type=media_type, headers=headers)
+
+
+@app.get("/api/groups")
+async def list_groups(
+    status: Optional[str] = None, limit: int = Query(100, ge=1, le=1000)
+):
+    """Error groups (same zap, same message shape), most recently seen first"""
+    return await get_error_groups(status, limit)
+
+
+@app.get("/api/groups/{group_id}")
+async def get_group(group_id: int):
+    """One error group with its most recent occurrences"""
+    group = await get_error_group(group_id)
+    if group is None:
+        raise HTTPException(status_code=404, detail="Group not found")
+    return group
+
+
+@app.patch("/api/groups/{group_id}")
+async def update_group(group_id: int, update: LogStatusUpdate):
+    """Resolve or dismiss a whole group; a resolved group reopens on recurrence"""
+    try:
+        success = await update_group_status(group_id, update.status)
+        if not success:
+            raise HTTPException(status_code=404, detail="Group not found")
+        return {"message": "Status updated"}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/api/templates")
+async def list_templates(
+    limit: int = Query(100, ge=1, le=1000), unexplained: bool = False
+):
+    """Templates mined from unexplained messages, largest cluster first"""
+    return await get_log_templates(limit, unexplained)
+
+
+@app.put("/api/templates/{template_id}/explanation")
+async def explain_template(template_id: int, body: TemplateExplanation):
+    """Attach an explanation to a template and its logs"""
+    updated = await set_template_explanation(template_id, body.explanation)
+    if updated is None:
+        raise HTTPException(status_code=404, detail="Template not found")
+    return {"message": f"Updated {updated} logs"}
+
+
+@app.get("/api/rules")
+async def list_rules():
+    """Explanation rules in match order, with the rule set version"""
+    return await get_explanation_rules()
+
+
+@app.get("/api/rules/cache")
+async def rule_cache_stats():
+    """Hit/miss/eviction counters of the explanation cache on this worker"""
+    return explainer.cache.stats()
+
+
+@app.post("/api/rules", status_code=201)
+async def create_rule(rule: RuleCreate):
+    """Add an explanation rule; all workers pick it up within a second"""
+    created = await create_explanation_rule(
+        rule.pattern, rule.explanation, rule.priority
+    )
+    if created is None:
+        raise HTTPException(status_code=409, detail="Pattern already exists")
+    await reloader.reload()
+    return created
+
+
+@app.patch("/api/rules/{rule_id}")
+async def update_rule(rule_id: int, update: RuleUpdate):
+    """Change a rule's pattern, explanation or priority"""
+    try:
+        rule = await update_explanation_rule(rule_id, **update.model_dump())
+    except sqlite3.IntegrityError:
+        raise HTTPException(status_code=409, detail="Pattern already exists")
+    if rule is None:
+        raise HTTPException(status_code=404, detail="Rule not found")
+    await reloader.reload()
+    return rule
+
+
+@app.delete("/api/rules/{rule_id}")
+async def delete_rule(rule_id: int):
+    """Remove an explanation rule"""
+    if not await delete_explanation_rule(rule_id):
+        raise HTTPException(status_code=404, detail="Rule not found")
+    await reloader.reload()
+    return {"message": "Rule deleted"}
+
+
+@app.get("/api/health")
+async def health():
+    """Report whether the database connection pool is usable"""
+    result = await check_health()
+    if not result["ok"]:
+        return JSONResponse(status_code=503, content=result)
+    return result
 
 
 # Frontend serving (for production)
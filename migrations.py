@@ -0,0 +1,186 @@
+import asyncio
+import os
+import sys
+import time
+from contextlib import nullcontext
+from typing import Callable, Dict, List, Optional, Set
+
+# Rough build speed used for cost estimates, and the size above which an
+# online migration is left for the background instead of blocking startup.
+MIGRATION_ROWS_PER_SECOND = int(os.environ.get("MIGRATION_ROWS_PER_SECOND", "500000"))
+ONLINE_MIGRATION_MIN_ROWS = int(os.environ.get("ONLINE_MIGRATION_MIN_ROWS", "50000"))
+
+
+class Migration:
+    """
+    One schema change. `apply(cursor)` runs inside a write transaction and
+    must be idempotent, because databases created before schema_version
+    existed run every migration once.
+
+    Online migrations (index builds) may be deferred until after startup;
+    `table` names the table whose size drives the cost estimate and `index`
+    the index the migration creates, if any.
+    """
+
+    def __init__(
+        self,
+        version: int,
+        name: str,
+        apply: Callable,
+        online: bool = False,
+        table: Optional[str] = None,
+        index: Optional[str] = None,
+    ):
+        self.version = version
+        self.name = name
+        self.apply = apply
+        self.online = online
+        self.table = table
+        self.index = index
+
+    def estimate(self, cursor) -> Dict:
+        """Estimated rows touched and seconds spent, without running it"""
+        rows = 0
+        already_built = self.index and _exists(cursor, "index", self.index)
+        if self.table and not already_built and _exists(cursor, "table", self.table):
+            # Rowid range instead of COUNT(*): two index lookups, not a scan
+            cursor.execute(f"SELECT MIN(rowid), MAX(rowid) FROM {self.table}")
+            low, high = cursor.fetchone()
+            rows = 0 if low is None else high - low + 1
+        return {
+            "version": self.version,
+            "name": self.name,
+            "online": self.online,
+            "rows": rows,
+            "seconds": round(rows / MIGRATION_ROWS_PER_SECOND, 2),
+        }
+
+
+def _exists(cursor, kind: str, name: str) -> bool:
+    cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = ? AND name = ?", (kind, name)
+    )
+    return cursor.fetchone() is not None
+
+
+def _ensure_version_table(cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at INTEGER NOT NULL
+        )
+    """
+    )
+
+
+def applied_versions(cursor) -> Set[int]:
+    if not _exists(cursor, "table", "schema_version"):
+        return set()
+    cursor.execute("SELECT version FROM schema_version")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def pending(pool, migrations: List[Migration]) -> List[Migration]:
+    """Migrations not applied yet, in version order"""
+    with pool.reader() as conn:
+        done = applied_versions(conn.cursor())
+    return sorted(
+        (m for m in migrations if m.version not in done), key=lambda m: m.version
+    )
+
+
+def apply(pool, migration: Migration) -> bool:
+    """Apply one migration in its own transaction; False if already applied"""
+    with pool.writer() as conn:
+        cursor = conn.cursor()
+        if migration.version in applied_versions(cursor):
+            return False
+        _ensure_version_table(cursor)
+        migration.apply(cursor)
+        cursor.execute(
+            "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+            (migration.version, migration.name, int(time.time())),
+        )
+        return True
+
+
+def plan(pool, migrations: List[Migration]) -> List[Dict]:
+    """Dry run: cost estimates for every pending migration, nothing applied"""
+    return [estimate(pool, migration) for migration in pending(pool, migrations)]
+
+
+def estimate(pool, migration: Migration) -> Dict:
+    with pool.reader() as conn:
+        return migration.estimate(conn.cursor())
+
+
+def migrate(pool, migrations: List[Migration], defer_online: bool = True) -> List[Migration]:
+    """
+    Apply pending migrations in order. Online migrations on large tables
+    are skipped when defer_online is set and returned, to be applied with
+    apply_online once the app is serving.
+    """
+    deferred = []
+    for migration in pending(pool, migrations):
+        if defer_online and migration.online:
+            if estimate(pool, migration)["rows"] >= ONLINE_MIGRATION_MIN_ROWS:
+                deferred.append(migration)
+                continue
+        apply(pool, migration)
+    return deferred
+
+
+async def apply_online(pool, migrations: List[Migration], pause: Callable = nullcontext):
+    """
+    Apply deferred migrations one at a time off the event loop. Each build
+    holds the write lock only for its own transaction; `pause` is entered
+    around it so the ingest queue buffers rows instead of waiting on the
+    lock.
+    """
+    for migration in migrations:
+        cost = await asyncio.to_thread(estimate, pool, migration)
+        print(
+            f"Applying migration {migration.version} ({migration.name}), "
+            f"about {cost['rows']} rows / {cost['seconds']}s"
+        )
+        try:
+            async with pause():
+                build = asyncio.ensure_future(asyncio.to_thread(apply, pool, migration))
+                try:
+                    await asyncio.shield(build)
+                except asyncio.CancelledError:
+                    # Shutting down: the thread cannot be interrupted, so let
+                    # the current build finish before the pool is closed
+                    await build
+                    raise
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️ Migration {migration.version} ({migration.name}) failed: {e}")
+            return
+
+
+if __name__ == "__main__":
+    import db
+    from connection_pool import ConnectionPool
+
+    if "--dry-run" in sys.argv:
+        if os.path.exists(db.DB_FILE):
+            pool = ConnectionPool(db.DB_FILE, readonly=True)
+        else:
+            # No database yet: every migration is pending and touches nothing
+            pool = ConnectionPool(":memory:")
+        estimates = plan(pool, db.MIGRATIONS)
+        pool.close()
+        for cost in estimates:
+            mode = "online" if cost["online"] else "blocking"
+            print(
+                f"{cost['version']:>4} {cost['name']:<40} {mode:<8} "
+                f"~{cost['rows']} rows, ~{cost['seconds']}s"
+            )
+        print(f"{len(estimates)} pending migrations")
+    else:
+        migrate(db.pool, db.MIGRATIONS, defer_online=False)
+        print("Schema is up to date")
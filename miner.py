@@ -0,0 +1,162 @@
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from fingerprint import normalize
+
+# Drain parameters: tree depth (the first DEPTH - 2 tokens pick the leaf),
+# the share of equal tokens a message needs to join a template, and how
+# many distinct tokens a node may branch on before using the wildcard.
+TEMPLATE_DEPTH = int(os.environ.get("TEMPLATE_DEPTH", "3"))
+TEMPLATE_SIMILARITY = float(os.environ.get("TEMPLATE_SIMILARITY", "0.4"))
+TEMPLATE_MAX_CHILDREN = int(os.environ.get("TEMPLATE_MAX_CHILDREN", "100"))
+
+WILDCARD = "<*>"
+
+
+def tokenize(message: str) -> List[str]:
+    """Normalized, whitespace-separated tokens of an error message"""
+    return normalize(message).split()
+
+
+class Template:
+    """A learned message template; `id` is None until it is stored"""
+
+    __slots__ = ("id", "tokens")
+
+    def __init__(self, tokens: List[str], template_id: Optional[int] = None):
+        self.id = template_id
+        self.tokens = tokens
+
+    @property
+    def text(self) -> str:
+        return " ".join(self.tokens)
+
+
+class TemplateMiner:
+    """
+    Online log template mining with a fixed-depth parse tree (Drain).
+
+    Messages are routed by token count and then by their first few tokens
+    to a small leaf of candidate templates, so adding a message costs one
+    pass over its tokens plus a comparison with the templates in its
+    leaf, independent of how many templates exist overall. A message
+    joins the most similar template in its leaf (tokens that differ become
+    wildcards) or starts a new one.
+    """
+
+    def __init__(
+        self,
+        depth: int = TEMPLATE_DEPTH,
+        similarity: float = TEMPLATE_SIMILARITY,
+        max_children: int = TEMPLATE_MAX_CHILDREN,
+    ):
+        self.prefix_length = max(depth - 2, 1)
+        self.similarity = similarity
+        self.max_children = max_children
+        self._root: Dict[int, Dict] = {}
+        self._templates: Dict[int, Template] = {}
+
+    def _path(self, tokens: List[str]) -> List[str]:
+        return [
+            WILDCARD if token == WILDCARD or token.startswith("<") or any(
+                ch.isdigit() for ch in token
+            ) else token
+            for token in tokens[: self.prefix_length]
+        ]
+
+    def _leaves(self, tokens: List[str], create: bool) -> List[List[Template]]:
+        """Leaves a message may belong to: its own path first, then wildcard detours"""
+        node = self._root.get(len(tokens))
+        if node is None:
+            if not create:
+                return []
+            node = self._root[len(tokens)] = {}
+        nodes = [node]
+        for token in self._path(tokens):
+            children = []
+            for node in nodes:
+                if token in node:
+                    children.append(node[token])
+                elif create and node is nodes[0]:
+                    key = token if len(node) < self.max_children else WILDCARD
+                    children.append(node.setdefault(key, {}))
+                if token != WILDCARD and WILDCARD in node:
+                    children.append(node[WILDCARD])
+            nodes = children
+        return [node.setdefault("", []) for node in nodes] if create else [
+            node[""] for node in nodes if "" in node
+        ]
+
+    def _score(self, template: Template, tokens: List[str]) -> Tuple[float, int]:
+        same = wildcards = 0
+        for have, want in zip(template.tokens, tokens):
+            if have == WILDCARD:
+                wildcards += 1
+            elif have == want:
+                same += 1
+        return (same / len(tokens) if tokens else 1.0), -wildcards
+
+    def match(self, message: str) -> Optional[Template]:
+        """Template a message would join, without learning from it"""
+        tokens = tokenize(message)
+        return self._best(tokens, self._leaves(tokens, create=False))
+
+    def _best(self, tokens: List[str], leaves: List[List[Template]]) -> Optional[Template]:
+        best, best_score = None, None
+        for leaf in leaves:
+            for template in leaf:
+                score = self._score(template, tokens)
+                if best_score is None or score > best_score:
+                    best, best_score = template, score
+        if best is None or best_score[0] < self.similarity:
+            return None
+        return best
+
+    def add(self, message: str) -> Tuple[Template, bool]:
+        """
+        Learn from one message. Returns its template and whether the
+        template is new or changed (and so needs to be stored).
+        """
+        tokens = tokenize(message)
+        leaves = self._leaves(tokens, create=True)
+        template = self._best(tokens, leaves)
+        if template is None:
+            template = Template(tokens)
+            leaves[0].append(template)
+            return template, True
+        merged = [
+            have if have == want else WILDCARD
+            for have, want in zip(template.tokens, tokens)
+        ]
+        if merged == template.tokens:
+            return template, False
+        self._place(template, merged)
+        return template, True
+
+    def _place(self, template: Template, tokens: List[str]):
+        """(Re)index a template under the path of its current tokens"""
+        if template.tokens is not tokens:
+            for leaf in self._leaves(template.tokens, create=False):
+                if template in leaf:
+                    leaf.remove(template)
+        template.tokens = tokens
+        leaf = self._leaves(tokens, create=True)[0]
+        if template not in leaf:
+            leaf.append(template)
+
+    def load(self, templates: Iterable[Tuple[int, str]]):
+        """Add or replace stored (id, template) pairs, e.g. learned by another worker"""
+        for template_id, text in templates:
+            template = self._templates.get(template_id)
+            if template is None:
+                template = self._templates[template_id] = Template([], template_id)
+            if template.tokens != text.split():
+                self._place(template, text.split())
+
+    def remember(self, template: Template):
+        """Record the id a new template was stored under"""
+        self._templates[template.id] = template
+
+    def reset(self):
+        self._root.clear()
+        self._templates.clear()
@@ -0,0 +1,147 @@
+import os
+import sqlite3
+import sys
+import tempfile
+from typing import Dict, List
+
+import db
+from connection_pool import ConnectionPool
+
+# Statements that are not queries over our tables
+_SKIP_PREFIXES = ("PRAGMA", "BEGIN", "COMMIT", "ROLLBACK", "CREATE", "DROP", "ALTER")
+
+
+def _exercise():
+    """Call every query function with each filter combination the API uses"""
+    db.init_db()
+    db.seed_explanation_rules([("not found", "Resource was renamed or deleted")])
+    ids = db.insert_error_logs(
+        [
+            ("Zap A", "Record 1234 not found", None, None),
+            ("Zap B", "rate limit", "API rate limit reached", 1_700_000_000_000),
+        ]
+    )
+    db.update_log_status(ids[0], "resolved")
+
+    for status in (None, "resolved"):
+        for zap_name in (None, "Zap A"):
+            for start, end in ((None, None), (0, None), (None, 2**53), (0, 2**53)):
+                logs, next_cursor, prev_cursor = db.get_logs_page(
+                    status, 1, None, start, end, zap_name
+                )
+                for cursor in (next_cursor, prev_cursor):
+                    if cursor:
+                        db.get_logs_page(status, 1, cursor, start, end, zap_name)
+                for _ in db.iter_logs(status, 100, start, end, zap_name):
+                    pass
+    cursor = db.encode_cursor("prev", {"event_ts": 0, "id": 0})
+    db.get_logs_page(None, 1, cursor)
+    db.get_change_version()
+    db.get_sync_state()
+    db.get_changes(0)
+    db.get_stats()
+    db.has_logs_to_roll_up()
+    db.roll_up_logs()
+    for group_by in db.ROLLUP_DIMENSIONS:
+        db.get_aggregates(group_by, "1h", 1_699_990_000_000, 1_700_100_000_000)
+
+    for status in (None, "unresolved"):
+        groups = db.get_error_groups(status)
+    if groups:
+        db.get_error_group(groups[0]["id"])
+        db.update_group_status(groups[0]["id"], "resolved")
+
+    for unexplained in (False, True):
+        templates = db.get_log_templates(unexplained=unexplained)
+    if templates:
+        db.set_template_explanation(templates[0]["id"], "Check the record id")
+
+    db.save_idempotency_keys(
+        [
+            {
+                "key": "k",
+                "request_hash": "h",
+                "status_code": 201,
+                "body": {"id": 1},
+                "created_at": 0,
+            }
+        ],
+        expire_before=0,
+    )
+    db.get_idempotency_key("k", 0)
+
+    db.prune_rollups({"1m": 2**53, "1h": 0})
+    db.get_zap_names()
+    db.delete_excess_logs("Zap A", db.get_excess_cut("Zap A", 1) or (2**53, 0))
+    for status in (None, "resolved"):
+        db.delete_expired_logs(1_700_000_000_001, status)
+    db.prune_tombstones(0)
+    db.incremental_vacuum(10)
+    db.get_rules_version()
+    rule = db.create_explanation_rule("timeout", "The app took too long")
+    db.update_explanation_rule(rule["id"], priority=5)
+    db.get_explanation_rules()
+    db.delete_explanation_rule(rule["id"])
+
+    # Purge one row only: the discarded table must still exist when the
+    # plans are explained
+    db.insert_error_logs([("Zap C", f"old {i}", None, None) for i in range(3)])
+    db.clear_all_logs()
+    db.purge_discarded_logs(1)
+    db.insert_error_logs([("Zap C", "archived", None, None)])
+    db.clear_all_logs(archive=True)
+    db.get_log_archives()
+
+
+def check_query_plans() -> List[Dict]:
+    """
+    Run every query function in db.py against a scratch database, record
+    the SQL it executes and return {"sql", "plan", "temp_btree"} for each
+    distinct statement. temp_btree means SQLite sorts with a temporary
+    B-tree because no index serves the ORDER BY / GROUP BY.
+    """
+    statements: List[str] = []
+    original_pool = db.pool
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "plans.db")
+        db.pool = ConnectionPool(path, trace=statements.append)
+        try:
+            _exercise()
+        finally:
+            db.pool.close()
+            db.pool = original_pool
+            # Miner and dedup state now describe the scratch database
+            db._reset_miner()
+            db._dedup_version = None
+
+        results, seen = [], set()
+        conn = sqlite3.connect(path)
+        try:
+            for sql in statements:
+                text = " ".join(sql.split())
+                if text in seen or text.upper().startswith(_SKIP_PREFIXES):
+                    continue
+                seen.add(text)
+                plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+                results.append(
+                    {
+                        "sql": text,
+                        "plan": plan,
+                        "temp_btree": any("USE TEMP B-TREE" in step for step in plan),
+                    }
+                )
+        finally:
+            conn.close()
+    return results
+
+
+if __name__ == "__main__":
+    # Exits non-zero when any query needs a sort, so it can gate CI
+    results = check_query_plans()
+    failures = [result for result in results if result["temp_btree"]]
+    for result in failures:
+        print(f"⚠️ Query needs a temporary B-tree: {result['sql']}")
+        for step in result["plan"]:
+            print(f"    {step}")
+    print(f"Checked {len(results)} statements, {len(failures)} need a sort")
+    sys.exit(1 if failures else 0)
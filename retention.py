@@ -0,0 +1,154 @@
+import asyncio
+import os
+import sys
+import time
+from typing import Dict
+
+import async_db
+
+# Retention policies; 0 disables each one. Logs older than LOG_RETENTION_DAYS
+# (by event time) are deleted, or after <STATUS>_RETENTION_DAYS for that
+# status, e.g. RESOLVED_RETENTION_DAYS=7. MAX_LOGS_PER_ZAP keeps only each
+# zap's newest logs.
+LOG_RETENTION_DAYS = float(os.environ.get("LOG_RETENTION_DAYS", "0"))
+RETENTION_DAYS = {
+    status: float(os.environ.get(f"{status.upper()}_RETENTION_DAYS", LOG_RETENTION_DAYS))
+    for status in ("unresolved", "resolved", "dismissed")
+}
+MAX_LOGS_PER_ZAP = int(os.environ.get("MAX_LOGS_PER_ZAP", "0"))
+
+# How often retention runs, how many logs each delete transaction removes
+# (more for tables discarded by a clear, which have no indexes left), the
+# pause between those transactions, how many tombstones delta sync keeps,
+# and how many free pages each incremental vacuum step returns.
+RETENTION_INTERVAL_SECONDS = float(os.environ.get("RETENTION_INTERVAL_SECONDS", "300"))
+RETENTION_BATCH_SIZE = int(os.environ.get("RETENTION_BATCH_SIZE", "500"))
+PURGE_BATCH_SIZE = int(os.environ.get("PURGE_BATCH_SIZE", "5000"))
+RETENTION_PAUSE_MS = float(os.environ.get("RETENTION_PAUSE_MS", "50"))
+MAX_TOMBSTONES = int(os.environ.get("MAX_TOMBSTONES", "10000"))
+VACUUM_PAGES = int(os.environ.get("VACUUM_PAGES", "1000"))
+
+
+class RetentionWorker:
+    """
+    Enforces the retention policies in the background, and empties the
+    tables clear_all_logs discards.
+
+    Deletes run in small transactions with a pause after each one, so
+    ingestion never waits long for the write lock, and they walk the
+    event-time indexes oldest first. Freed pages are handed back to the
+    file system a step at a time with incremental vacuum.
+    """
+
+    def __init__(
+        self,
+        interval: float = RETENTION_INTERVAL_SECONDS,
+        batch_size: int = RETENTION_BATCH_SIZE,
+        pause_ms: float = RETENTION_PAUSE_MS,
+    ):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause_ms / 1000
+        self._task = None
+        self._wakeup = None
+
+    async def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    def wake(self):
+        """Run now instead of at the next interval, e.g. after a clear"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _drain(self, delete, *args) -> int:
+        """Call a batched delete until it comes back short"""
+        total = 0
+        while True:
+            count = await delete(*args, self.batch_size)
+            total += count
+            if count < self.batch_size:
+                return total
+            await asyncio.sleep(self.pause)
+
+    async def run_once(self) -> Dict[str, int]:
+        """Apply every policy once; returns what was removed"""
+        result = {"expired": 0, "excess": 0, "tombstones": 0, "purged": 0}
+        now = time.time()
+        for status, days in RETENTION_DAYS.items():
+            if days > 0:
+                before = int((now - days * 86400) * 1000)
+                result["expired"] += await self._drain(
+                    async_db.delete_expired_logs, before, status
+                )
+        if MAX_LOGS_PER_ZAP > 0:
+            for zap_name in await async_db.get_zap_names():
+                # Found once on a reader, not inside every delete transaction
+                cut = await async_db.get_excess_cut(zap_name, MAX_LOGS_PER_ZAP)
+                if cut is not None:
+                    result["excess"] += await self._drain(
+                        async_db.delete_excess_logs, zap_name, cut
+                    )
+        result["tombstones"] = await async_db.prune_tombstones(MAX_TOMBSTONES)
+        while True:
+            count = await async_db.purge_discarded_logs(PURGE_BATCH_SIZE)
+            if count is None:
+                break
+            result["purged"] += count
+            await asyncio.sleep(self.pause)
+        previous = None
+        while True:
+            # Without auto_vacuum=INCREMENTAL the free list never shrinks
+            free_pages = await async_db.incremental_vacuum(VACUUM_PAGES)
+            if free_pages == 0 or free_pages == previous:
+                break
+            previous = free_pages
+            await asyncio.sleep(self.pause)
+        result["free_pages"] = free_pages
+        return result
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                print(f"⚠️ Failed to apply log retention: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+
+retention_worker = RetentionWorker()
+
+
+async def _run_once():
+    async_db.start()
+    try:
+        return await RetentionWorker().run_once()
+    finally:
+        async_db.shutdown()
+
+
+if __name__ == "__main__":
+    import db
+
+    if "--enable-incremental-vacuum" in sys.argv:
+        if db.enable_incremental_vacuum():
+            print("Incremental vacuum enabled")
+        else:
+            print("Incremental vacuum was already enabled")
+    else:
+        db.init_db()
+        print(asyncio.run(_run_once()))
@@ -0,0 +1,108 @@
+import asyncio
+import os
+import time
+from typing import Dict
+
+import async_db
+
+# How often new logs are rolled up and how many per transaction, and how
+# often expired buckets are pruned.
+ROLLUP_INTERVAL_SECONDS = float(os.environ.get("ROLLUP_INTERVAL_SECONDS", "1"))
+ROLLUP_BATCH_SIZE = int(os.environ.get("ROLLUP_BATCH_SIZE", "5000"))
+ROLLUP_PRUNE_SECONDS = float(os.environ.get("ROLLUP_PRUNE_SECONDS", "600"))
+
+# Days each resolution is kept (0 keeps it forever): minutes for recent
+# detail, hours for a year of trends, days for all history.
+ROLLUP_RETENTION_DAYS = {
+    "1m": float(os.environ.get("MINUTE_ROLLUP_RETENTION_DAYS", "7")),
+    "1h": float(os.environ.get("HOUR_ROLLUP_RETENTION_DAYS", "400")),
+    "1d": float(os.environ.get("DAY_ROLLUP_RETENTION_DAYS", "0")),
+}
+
+
+class RollupWorker:
+    """
+    Maintains the log_rollups tiers in the background.
+
+    New logs are counted in batches of ids after the rollup watermark, so
+    ingestion never pays for the rollups and a burst of inserts is counted
+    with a few upserts per bucket. Fine-grained buckets are pruned once
+    they are older than their tier's retention; coarser tiers keep the
+    history, also after the raw logs are gone. Every worker may run one:
+    batches are claimed inside the write transaction.
+    """
+
+    def __init__(
+        self,
+        interval: float = ROLLUP_INTERVAL_SECONDS,
+        batch_size: int = ROLLUP_BATCH_SIZE,
+        prune_interval: float = ROLLUP_PRUNE_SECONDS,
+    ):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.prune_interval = prune_interval
+        self._pruned_at = None
+        self._task = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def catch_up(self) -> int:
+        """Roll up every log inserted so far; returns how many were counted"""
+        # Checked on a reader so an idle worker never takes the write lock
+        if not await async_db.has_logs_to_roll_up():
+            return 0
+        total = 0
+        while True:
+            count = await async_db.roll_up_logs(self.batch_size)
+            total += count
+            if count < self.batch_size:
+                return total
+
+    def cutoffs(self) -> Dict[str, int]:
+        now = time.time()
+        return {
+            resolution: int((now - days * 86400) * 1000)
+            for resolution, days in ROLLUP_RETENTION_DAYS.items()
+            if days > 0
+        }
+
+    async def prune(self) -> int:
+        """Delete expired buckets, one batch per transaction"""
+        self._pruned_at = time.monotonic()
+        cutoffs = self.cutoffs()
+        total = 0
+        while cutoffs:
+            count = await async_db.prune_rollups(cutoffs, self.batch_size)
+            total += count
+            if count < self.batch_size:
+                break
+            # Let queued writes take the lock between batches
+            await asyncio.sleep(0.05)
+        return total
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.catch_up()
+                if (
+                    self._pruned_at is None
+                    or time.monotonic() - self._pruned_at >= self.prune_interval
+                ):
+                    await self.prune()
+            except Exception as e:
+                print(f"⚠️ Failed to update log rollups: {e}")
+
+
+rollup_worker = RollupWorker()